@@ -14,28 +14,76 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-# import json
+import os
+import json
 import argparse
-import smbus2
 import time
 import struct
 import register_definitions
-import ft230x
+import flash_layout
+import flash_dump
+import flash_image
+import command_polling
+import multi_board
+import pd_monitor
+import tracing
+import catalog
+import flash_daemon
+import journal
+import station_metrics
+import transports
 
 
-def initialize_argparse():
+def initialize_argparse(argv = None):
     parser = argparse.ArgumentParser(description="Flash the PD Controller SPI flash via I2C.")
     parser.add_argument("--bus", type=int, default=0x1, help="I2C bus number")
+    parser.add_argument("--identify", action="store_true", help="Identify the configuration held by the flash against the catalog of known binaries")
+    parser.add_argument("--catalog", type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "tps-config-binaries"), help="Directory with the known configuration binaries")
+    parser.add_argument("--snapshot", type=str, help="Save the registers of both PD Controller ports as JSON, decoded where their fields are known and raw otherwise")
+    parser.add_argument("--snapshot_compare", type=str, help="Print the registers which differ from a snapshot saved with --snapshot")
+    parser.add_argument("--monitor", type=str, help="Record changes of the status, power and contract registers of both ports into MONITOR")
+    parser.add_argument("--monitor_format", choices=pd_monitor.series_formats.keys(), default="csv", help="Monitor output format, one CSV row per changed field or binary records of the raw registers")
+    parser.add_argument("--monitor_duration", type=float, default=0, help="Seconds to monitor (default: until interrupted)")
+    parser.add_argument("--monitor_interval", type=float, default=0, help="Seconds between samples (default: back to back)")
     parser.add_argument("--dump", type=str, help="Dump flash content into a file")
-    parser.add_argument("--erase", action="store_true", help="Erase flash")
+    parser.add_argument("--dump_format", nargs="+", choices=flash_dump.dump_formats.keys(), default=["raw", "hex"], help="Dump output formats: raw fills skipped space with erased 0xFF bytes, sparse leaves it as file system holes which read back as 0x00")
+    parser.add_argument("--dump_offset", type=lambda x: int(x, 0), default=0, help="Resume an interrupted dump from DUMP_OFFSET")
+    parser.add_argument("--smart_dump", action="store_true", help="Dump only the region pointers and populated regions")
+    parser.add_argument("--erase", action="store_true", help="Erase flash (only the sectors covered by the --write image or --erase_range if given)")
+    parser.add_argument("--erase_range", type=range_argument, help="Limit erase to the START:END address range, both 4KB sector aligned")
     parser.add_argument("--write", type=str, help="Write flash with the binary image")
+    parser.add_argument("--verify", type=str, help="Verify flash content against the binary image")
+    parser.add_argument("--verify_mode", choices=["readback", "boot_flags"], default="readback", help="Compare CRCs of the read back sectors, or compare the region pointers, headers and configuration sections and trust the Boot Flags region CRC check after a cold reset")
+    parser.add_argument("--analyze", type=str, help="Print the flash layout of a binary image and check it without connecting to the board")
+    parser.add_argument("--skip_image_check", action="store_true", help="Write or verify images whose region headers or CRCs are invalid")
     parser.add_argument("--truncate", type=int, help="Limit R/W operation to TRUNCATE Kbytes")
     parser.add_argument("--force", action="store_true", help="Force write flash with the binary image")
+    parser.add_argument("--diff", action="store_true", help="Erase and write only the 4KB sectors which differ from the binary image; patch data is trusted when its region header matches, everything else is read back")
+    parser.add_argument("--journal", type=str, help="Record confirmed sectors of --dump/--erase/--write in JOURNAL and resume an interrupted run from it")
     parser.add_argument("--ft230x", action="store_true", help="Use FT230X for flashing instead of internal I2C Bus")
+    parser.add_argument("--ftdi_addr", type=str, default="ftdi://ftdi/1", help="FT230X adapter URL used with --ft230x")
+    parser.add_argument("--ft230x_calibrate", action="store_true", help="Measure the fastest reliable FT230X bit rate again instead of using the cached one")
+    parser.add_argument("--ft230x_keep_gpio", action="store_true", help="Leave the FT230X CBUS pins configured as GPIO on exit, for a batch of runs")
+    parser.add_argument("--transport", choices=transports.registry.keys(), help=f"Bus transport (default: smbus, or ft230x with --ft230x), more can be added with {transports.PLUGINS_VARIABLE}=name=module:factory,...")
+    parser.add_argument("--targets", nargs="+", help="Run on several boards at once, given as I2C bus numbers and/or FT230X URLs (ftdi://...), URLs only with --ft230x")
+    parser.add_argument("--jobs", type=int, help="Number of boards handled at the same time with --targets (default: all)")
     parser.add_argument("--debug_flash_config", action="store_true", help="Debug attempt of flash configuration loading")
+    parser.add_argument("--retries", type=int, default=3, help="Retries of a failed I2C transaction, each after a bus recovery")
+    parser.add_argument("--command_retries", type=int, default=2, help="Retries of a failed idempotent 4CC command (FLwd is retried after re-sending FLad)")
+    parser.add_argument("--polling", choices=command_polling.polling_strategies.keys(), default="learned", help="4CC completion polling strategy")
+    parser.add_argument("--latency_stats", action="store_true", help="Print 4CC latency statistics at the end of the run")
+    parser.add_argument("--trace", type=str, help="Save I2C transaction and 4CC trace records as JSON Lines")
+    parser.add_argument("--trace_chrome", type=str, help="Save I2C transaction and 4CC trace records in Chrome trace format")
+    parser.add_argument("--trace_size", type=int, default=65536, help="Number of most recent trace records kept")
+    parser.add_argument("--daemon", type=str, help="Keep the boards connected and serve requests sent with --socket on the DAEMON Unix socket")
+    parser.add_argument("--socket", type=str, help="Run this invocation on the daemon listening on SOCKET")
+    parser.add_argument("--socket_mode", type=lambda x: int(x, 8), default=0o600, help="Permissions of the --daemon socket in octal (default: 600, owner only; 660 admits the owner group)")
+    parser.add_argument("--cache_ttl", type=float, default=1.0, help="Seconds the daemon serves repeated status register reads from its cache")
+    parser.add_argument("--progress_fd", type=int, help="Stream phase progress, throughput, retries and ETA as JSON Lines to file descriptor PROGRESS_FD")
+    parser.add_argument("--metrics_textfile", type=str, help="Save per-phase timing and throughput as a Prometheus textfile at the end of the run")
     parser.add_argument("-vi", "--verbose_i2c", action="store_true", help="print I2C transactions")
     parser.add_argument("-v4", "--verbose_4cc", action="store_true", help="print 4CC transactions")
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
 def int32_to_bytes(x):
@@ -54,128 +102,554 @@ def is_bit_set(byte, bit_index):
     return (byte & (1 << bit_index)) != 0
 
 
+FLASH_SIZE = 1024 * 1024
+FLASH_SECTOR_SIZE = 4 * 1024
+FLASH_ERASE_MAX_SECTORS = 128  # sectors erased by a single FLem, fits in its 10s timeout
+FLASH_WRITE_SIZE = 64
+COLD_RESET_DELAY = 5  # seconds the PD Controller may take to reload the configuration
+RESET_START_TIMEOUT = 0.5  # seconds for a cold reset to take the PD Controller off the bus
+READY_POLL_INTERVAL = 0.01
+STARTUP_TIMEOUT = 1
+RETRY_DELAY = 0.001  # seconds between a bus recovery and the retried transaction
+# Commands which leave the device in the same state when executed twice, FLwd auto-increments the flash address
+IDEMPOTENT_COMMANDS = ("FLrd", "FLad", "FLem")
+
+
+def parse_range(text):
+    # (start, end) of a START:END range of whole sectors within the flash
+    try:
+        start, end = (int(value, 0) for value in text.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{text} is not a START:END range")
+    if not 0 <= start < end <= FLASH_SIZE:
+        raise argparse.ArgumentTypeError(f"{text} is not a non-empty range within the {FLASH_SIZE // 1024}KB flash")
+    if start % FLASH_SECTOR_SIZE or end % FLASH_SECTOR_SIZE:
+        raise argparse.ArgumentTypeError(f"{text} is not aligned to the {FLASH_SECTOR_SIZE // 1024}KB sectors")
+    return start, end
+
+
+def range_argument(text):
+    # The option keeps its text form, it is part of the journal job and of daemon requests
+    parse_range(text)
+    return text
+
+
+def plan_erase(ranges):
+    # Merge the 4KB sectors covered by (start, end) ranges into the fewest (addr, sectors) FLem commands
+    sectors = sorted({sector for start, end in ranges for sector in range(start // FLASH_SECTOR_SIZE, -(-end // FLASH_SECTOR_SIZE))})
+    plan = []
+    for sector in sectors:
+        if plan and plan[-1][0] // FLASH_SECTOR_SIZE + plan[-1][1] == sector and plan[-1][1] < FLASH_ERASE_MAX_SECTORS:
+            plan[-1] = (plan[-1][0], plan[-1][1] + 1)
+        else:
+            plan.append((sector * FLASH_SECTOR_SIZE, 1))
+    return plan
+
+
+def plan_write(image, ranges):
+    # Split (start, end) ranges of a FlashImage into contiguous (start, end) runs of non-erased 64 byte chunks
+    runs = []
+    for start, end in ranges:
+        for sector in range(start - start % FLASH_SECTOR_SIZE, end, FLASH_SECTOR_SIZE):
+            part_start = max(start, sector)
+            part_end = min(end, sector + FLASH_SECTOR_SIZE)
+            # Erased sectors are skipped with a single comparison
+            if image.erased(part_start, part_end - part_start):
+                continue
+            for addr in range(part_start, part_end, FLASH_WRITE_SIZE):
+                if image.erased(addr, FLASH_WRITE_SIZE):
+                    continue
+                if runs and runs[-1][1] == addr:
+                    runs[-1] = (runs[-1][0], addr + FLASH_WRITE_SIZE)
+                else:
+                    runs.append((addr, addr + FLASH_WRITE_SIZE))
+    return runs
+
+
+def exclude_sectors(ranges, sectors):
+    # Cut the given 4KB sectors out of (start, end) ranges
+    kept = []
+    for start, end in ranges:
+        for sector in range(start - start % FLASH_SECTOR_SIZE, end, FLASH_SECTOR_SIZE):
+            if sector not in sectors:
+                kept.append((max(start, sector), min(end, sector + FLASH_SECTOR_SIZE)))
+    return flash_layout.merge_ranges(kept)
+
+
+def plan_diff(PDC, image, memtop, skip = ()):
+    # (start, end) ranges of the 4KB sectors whose flash content differs from the image, the sectors in skip are left out
+    # Reading back costs four FLrd per FLwd, so the patch data of a region is trusted without reading it when the region
+    # header, patch CRC word included, matches the image; headers are written last (headers_last), a matching header
+    # is not left in front of a partially written patch by an interrupted run
+    # A region which failed the last boot is rewritten, the region pointers, configuration sections and any other data
+    # the image holds are read back
+    image_read = lambda addr, length: image.read(addr, length, memtop)
+    boot_flags = PDC.snapshot([register_definitions.boot_flags])[register_definitions.boot_flags.name]
+    differing = set()
+    compare_ranges = []
+    trusted_ranges = []
+    for pointer in flash_layout.region_pointers:
+        compare_ranges += [(pointer.pointer_address, pointer.pointer_address + 4), (pointer.offset_address, pointer.offset_address + 4)]
+    for region in range(len(flash_layout.region_pointers)):
+        header = flash_layout.read_region_header(image_read, region)
+        if header is None:
+            continue
+        sections = [(name, start, min(end, memtop)) for name, start, end in flash_layout.region_sections(header) if start < memtop]
+        if not sections:
+            continue
+        name, header_start, header_end = sections[0]
+        boot_failed = boot_flags[f"region{region}_read_attempt"] and any(boot_flags[f"region{region}_{flag}"] for flag in ("header_invalid", "read_invalid", "crc_fail"))
+        if boot_failed or not PDC.FlashCompare(header_start, image_read(header_start, header_end - header_start)):
+            differing.update(sector for name, start, end in sections for sector in range(start - start % FLASH_SECTOR_SIZE, end, FLASH_SECTOR_SIZE))
+            continue
+        for name, start, end in sections:
+            (trusted_ranges if name in ("header", "patch") else compare_ranges).append((start, end))
+    # Data outside the regions is compared as well, the erased chunks of the image are left alone
+    trusted = flash_layout.merge_ranges(trusted_ranges)
+    compare_ranges += flash_layout.subtract_ranges(plan_write(image, [(0, memtop)]), trusted)
+    compare_ranges = [(start, min(end, memtop)) for start, end in flash_layout.merge_ranges(compare_ranges, 16) if start < memtop]
+    print(f"Comparing {int(sum(end - start for start, end in compare_ranges) / 1024)}KB of flash memory with the image, {int(sum(end - start for start, end in trusted) / 1024)}KB trusted by the region headers...")
+    for sector_addr in range(0, memtop, FLASH_SECTOR_SIZE):
+        if sector_addr in differing or sector_addr in skip:
+            continue
+        sector_end = min(sector_addr + FLASH_SECTOR_SIZE, memtop)
+        parts = [(max(start, sector_addr), min(end, sector_end)) for start, end in compare_ranges if start < sector_end and end > sector_addr]
+        if not all(PDC.FlashCompare(start, image_read(start, end - start)) for start, end in parts):
+            differing.add(sector_addr)
+    differing -= set(skip)
+    return [(sector, min(sector + FLASH_SECTOR_SIZE, memtop)) for sector in sorted(differing)]
+
+
+def headers_last(image, runs, memtop):
+    # Move the chunks holding region headers to the end of a write plan, a region header is only written once
+    # the rest of the flash holds the image
+    image_read = lambda addr, length: image.read(addr, length, memtop)
+    headers = []
+    for region in range(len(flash_layout.region_pointers)):
+        header = flash_layout.read_region_header(image_read, region)
+        if header is not None:
+            headers.append((header.address, header.address + flash_layout.REGION_HEADER_SIZE))
+    headers = flash_layout.merge_ranges(headers, FLASH_WRITE_SIZE)
+    deferred = [(max(start, header_start), min(end, header_end)) for start, end in runs for header_start, header_end in headers if start < header_end and end > header_start]
+    return flash_layout.subtract_ranges(runs, headers) + deferred
+
+
 class TPS65988:
-    def __init__(self, bus_no, i2c_addr1 = 0x23, i2c_addr2 = 0x27, use_ft230x = False, debug_i2c = True, debug_4cc = False):
+    def __init__(self, bus_no, i2c_addr1 = 0x23, i2c_addr2 = 0x27, use_ft230x = False, debug_i2c = True, debug_4cc = False, polling = "learned", ftdi_addr = "ftdi://ftdi/1", bus = None, tracer = None, retries = 3, command_retries = 2, cache_ttl = 0, keep_gpio = False, calibrate = False, transport = None):
         self.bus_no = bus_no
-        self.use_ft230x = use_ft230x
         self.i2c_addr = i2c_addr1  # assume device 1 for 4CC
         self.i2c_addr1 = i2c_addr1
         self.i2c_addr2 = i2c_addr2
         self.debug_i2c = debug_i2c
         self.debug_4cc = debug_4cc   
+        self.polling = command_polling.polling_strategies[polling]()
+        self.command_stats = command_polling.CommandStats()
+        self.tracer = tracer
+        self.metrics = None  # StationMetrics of the run in progress
+        self.command = None  # 4CC in progress, for tracing
+        self.retries = retries
+        self.command_retries = command_retries
+        self.retry_counts = {"transaction": 0, "4cc": 0, "bus_recovery": 0}
+        # Status registers read within cache_ttl seconds are served from the cache, any 4CC command clears it
+        self.cache_ttl = cache_ttl
+        self.register_cache = {}
+        self.immutable_cache = {}
+        self.reboot_times = []  # seconds each cold reset took, as observed by WaitReady
+        self.ready = False  # WaitReady saw the controller out of its boot loader, a daemon session skips the startup wait
         
-        if not use_ft230x:
-            try:
-                # Try to initialize using smbus2            
-                self.bus = smbus2.SMBus(bus_no)
-            except Exception:
-                print("Claiming Internal I2C bus failed")
-                exit()
-        else:
+        # Transports are loaded on demand, a native bus run does not import the USB stack
+        transport = transport or ("ft230x" if use_ft230x else "smbus")
+        try:
+            self.bus = transports.open_transport(transport, ftdi_addr if transport == "ft230x" else bus_no, bus = bus, verbose = debug_i2c, debug = debug_i2c, keep_gpio = keep_gpio)
+        except Exception as e:
+            print(e)
+            print(f"Opening the {transport} transport failed")
+            exit()
+        self.transport = self.bus.name
+        if bus is None:
+            # FT230X adapters are calibrated on first use, the result is cached per serial number
+            self.bus.calibrate(self.calibration_probe, calibrate)
+
+    def with_retries(self, transaction, retry, *args, **kwargs):
+        # Run a bus transaction, retrying it after a bus recovery when it fails
+        for attempt in range(self.retries + 1):
             try:
-                # Try to connect to FT230X   
-                self.bus = ft230x.cbusBitBang(ftdi_addr = "ftdi://ftdi/1", i2c_debug = self.debug_i2c)
-            except Exception as e:               
-                print(e)
-                print("Connecting to the FT230X failed")
-                exit()
-            
-               
-    def i2c_write(self, reg, data, debugname = ""):
+                return transaction(*args, **kwargs)
+            except (OSError, ValueError) as e:
+                if not retry or attempt == self.retries:
+                    raise
+                if self.debug_i2c:
+                    print(f"I2C transaction failed ({e}), retrying")
+                self.retry_counts["transaction"] += 1
+                self.recover_bus()
+
+    def recover_bus(self):
+        # The FT230X has to release a stuck target itself, I2C adapter drivers recover on their own
+        recovered = self.bus.recover()
+        if recovered is not None:
+            self.retry_counts["bus_recovery"] += 1
+            if not recovered:
+                print("SDA is still held low after the bus recovery")
+        time.sleep(RETRY_DELAY)
+
+    def i2c_write(self, reg, data, debugname = "", retry = True):
+        # retry = False leaves a failed write to the caller, for registers which trigger an action
+        return self.with_retries(self.i2c_write_once, retry, reg, data, debugname)
+
+    def i2c_read(self, reg, dlen = 255, debugname = "", quiet = False):
+        return self.with_retries(self.i2c_read_once, True, reg, dlen, debugname, quiet)
+
+    def i2c_write_once(self, reg, data, debugname = ""):
         dlength = len(data)
         if isinstance(data, str):
             data = [ord(d) for d in data]
         if self.debug_i2c:
             print(f"Write to {reg:#02x} {debugname} bytes: {dlength}")
 
-        if self.use_ft230x:
-            msg = self.bus.write_block_to_i2c(self.i2c_addr,reg,[dlength & 0xFF]+ list(data))
-        else:    
-            msg = smbus2.i2c_msg.write(self.i2c_addr, [reg & 0xFF, dlength & 0xFF] + list(data))
-            self.bus.i2c_rdwr(msg)
+        start = time.perf_counter() if self.tracer is not None else 0
+        ack = True
+        try:
+            self.bus.write(self.i2c_addr, reg, data)
+        except (OSError, ValueError):
+            ack = False
+            raise
+        finally:
+            if self.tracer is not None:
+                self.trace("write", start, reg, dlength, ack)
 
-    def i2c_read(self, reg, dlen = 255, debugname = ""):
+    def i2c_read_once(self, reg, dlen = 255, debugname = "", quiet = False):
         dlen += 1  # accomodate for data length header
 
-        if self.use_ft230x:
-            msg = self.bus.read_block_from_i2c(self.i2c_addr,reg,dlen)
-        else:    
-            msgw = smbus2.i2c_msg.write(self.i2c_addr, [reg])
-            msg = smbus2.i2c_msg.read(self.i2c_addr, dlen)
-            self.bus.i2c_rdwr(msgw, msg)
-            
-        if msg != -1:
-            output = list(msg)
-        else:
-            raise ValueError("Device unresponsive")
-        if self.debug_i2c:
+        start = time.perf_counter() if self.tracer is not None else 0
+        ack = True
+        try:
+            output = self.bus.read(self.i2c_addr, reg, dlen)
+        except (OSError, ValueError):
+            ack = False
+            raise
+        finally:
+            if self.tracer is not None:
+                self.trace("read", start, reg, dlen, ack)
+
+        if self.debug_i2c and not quiet:
             print(f"Read from to {reg:#02x} {debugname} bytes: {len(output) - 1} / {output[0]}")
-        if self.debug_i2c:
             print(" ".join(["{:02x}".format(o) for o in output]))
         return output
 
-    def command_4CC(self, command, data, outdatalen, timeout = 1):
+    def calibration_probe(self):
+        # FW Version read for the FT230X calibration, -1 when it was not acknowledged
+        try:
+            return self.i2c_read_once(register_definitions.firmware_version.address, register_definitions.firmware_version.size, register_definitions.firmware_version.name, quiet = True)
+        except (OSError, ValueError):
+            return -1
+
+    def i2c_transfer(self, operations, retry = True, quiet = False):
+        # Register writes ("write", reg, data) and reads ("read", reg, dlen) submitted together, returns the read contents
+        return self.with_retries(self.i2c_transfer_once, retry, operations, quiet)
+
+    def i2c_transfer_once(self, operations, quiet = False):
+        if not self.bus.combines_transfers:
+            outputs = []
+            for operation in operations:
+                if operation[0] == "write":
+                    self.i2c_write_once(operation[1], operation[2])
+                else:
+                    outputs.append(self.i2c_read_once(operation[1], operation[2], quiet = quiet))
+            return outputs
+
+        # Submitted at once, with repeated starts between the accesses
+        accesses = []
+        for operation in operations:
+            if operation[0] == "write":
+                data = operation[2]
+                if isinstance(data, str):
+                    data = [ord(d) for d in data]
+                if self.debug_i2c:
+                    print(f"Write to {operation[1]:#02x} bytes: {len(data)}")
+                accesses.append(("write", operation[1], data))
+            else:
+                accesses.append(("read", operation[1], operation[2] + 1))
+        start = time.perf_counter() if self.tracer is not None else 0
+        ack = True
+        try:
+            outputs = self.bus.transfer(self.i2c_addr, accesses)
+        except (OSError, ValueError):
+            ack = False
+            raise
+        finally:
+            if self.tracer is not None:
+                for operation in operations:
+                    self.trace(operation[0], start, operation[1], len(operation[2]) if operation[0] == "write" else operation[2] + 1, ack)
+        if self.debug_i2c and not quiet:
+            for output in outputs:
+                print(" ".join(["{:02x}".format(o) for o in output]))
+        return outputs
+
+    def read_register(self, register):
+        return self.read_registers([register])[register.address]
+
+    def read_registers(self, registers):
+        # Register contents ([length] + data) keyed by address, the ones not cached are read in as few submissions as possible
+        # Immutable registers are cached until the next cold reset, the others for cache_ttl seconds
+        outputs = {}
+        pending = []
+        now = time.monotonic()
+        for register in registers:
+            key = (self.i2c_addr, register.address)
+            cached = self.register_cache.get(key)
+            if register.immutable and key in self.immutable_cache:
+                outputs[register.address] = self.immutable_cache[key]
+            elif self.cache_ttl and cached is not None and now - cached[0] < self.cache_ttl:
+                outputs[register.address] = cached[1]
+            else:
+                pending.append(register)
+        for idx in range(0, len(pending), self.bus.max_reads):
+            batch = pending[idx : idx + self.bus.max_reads]
+            for register, output in zip(batch, self.i2c_transfer([("read", register.address, register.size) for register in batch], quiet = True)):
+                outputs[register.address] = output
+                if register.immutable:
+                    self.immutable_cache[(self.i2c_addr, register.address)] = output
+                elif self.cache_ttl:
+                    self.register_cache[(self.i2c_addr, register.address)] = (time.monotonic(), output)
+        return outputs
+
+    def snapshot(self, registers = register_definitions.registers, i2c_addr = None):
+        # Decoded register contents keyed by register name and field name, comparable with register_definitions.diff_snapshots
+        previous_addr = self.i2c_addr
+        self.i2c_addr = i2c_addr or self.i2c_addr
+        try:
+            outputs = self.read_registers(registers)
+        finally:
+            self.i2c_addr = previous_addr
+        return {register.name: register_definitions.decode(register, outputs[register.address]) for register in registers}
+
+    def trace(self, kind, start, reg, length, ack):
+        usb_ops = self.bus.last_usb_ops if kind != "4cc" else 0
+        self.tracer.record(start, time.perf_counter() - start, self.transport, kind, self.i2c_addr, reg, length, ack, self.command, usb_ops)
+
+    def command_4CC(self, command, data, outdatalen, timeout = 1, prepare = None):
+        # Retry failed idempotent commands, prepare() restores the device state another command depends on (FLad for FLwd)
+        attempts = self.command_4CC_attempts(command, outdatalen, prepare is not None)
+        try:
+            step = next(attempts)
+            while True:
+                if step[0] == "prepare":
+                    step = attempts.send(prepare())
+                elif step[0] == "recover":
+                    self.recover_bus()
+                    step = next(attempts)
+                else:
+                    try:
+                        output = self.traced_command_4CC(command, data, outdatalen, timeout, step[1])
+                    except (OSError, ValueError) as e:
+                        step = attempts.throw(e)
+                    else:
+                        step = attempts.send(output)
+        except StopIteration as stop:
+            return stop.value
+
+    def command_4CC_attempts(self, command, outdatalen, prepare = False):
+        # The 4CC retry policy as ("prepare",), ("command", retry) and ("recover",) steps, shared by the sync and async drivers
+        # A prepare step is sent the prepare() code, a command step its output or thrown its bus error
+        # The generator returns the command output
+        self.register_cache.clear()
+        retries = self.command_retries if command in IDEMPOTENT_COMMANDS or prepare else 0
+        for attempt in range(retries + 1):
+            if attempt:
+                print(f"Retrying 4CC {command}")
+                self.retry_counts["4cc"] += 1
+                if prepare and (yield ("prepare",)) != [0x40, 0]:
+                    continue
+            try:
+                # FLwd is recovered through prepare() only, a resent CMD1 write could run it twice at the incremented address
+                output = yield ("command", command in IDEMPOTENT_COMMANDS)
+            except (OSError, ValueError) as e:
+                if attempt == retries:
+                    raise
+                print(f"4CC {command} failed: {e}")
+                yield ("recover",)
+                continue
+            if output is not None or outdatalen == 0:
+                return output
+        return None
+
+    def traced_command_4CC(self, command, data, outdatalen, timeout, retry):
+        self.command = command
+        trace_start = time.perf_counter() if self.tracer is not None else 0
+        output = None
+        try:
+            output = self.run_command_4CC(command, data, outdatalen, timeout, retry)
+        finally:
+            if self.tracer is not None:
+                self.trace("4cc", trace_start, register_definitions.command1.address, len(data), output is not None)
+            self.command = None
+        return output
+
+    def run_command_4CC(self, command, data, outdatalen, timeout, retry = True):
+        # Perform the command steps with blocking transfers and sleeps
+        steps = self.command_4CC_steps(command, data, outdatalen, timeout, retry)
+        try:
+            step = next(steps)
+            while True:
+                if step[0] == "sleep":
+                    time.sleep(step[1])
+                    step = next(steps)
+                else:
+                    step = steps.send(self.i2c_transfer(*step[1:]))
+        except StopIteration as stop:
+            return stop.value
+
+    def command_4CC_steps(self, command, data, outdatalen, timeout, retry = True):
+        # The 4CC protocol as ("transfer", operations, retry, quiet) and ("sleep", seconds) steps
+        # A transfer step is sent its outputs back, the generator returns the command output
+        writes = [("write", register_definitions.command1.address, command)]
         if len(data):
-            self.i2c_write(register_definitions.data1.address, data, register_definitions.data1.name)
-        self.i2c_write(register_definitions.command1.address, command, register_definitions.command1.name)
-        timeout += time.time()
-        holddebug = self.debug_i2c
-        self.debug_i2c = False
+            writes.insert(0, ("write", register_definitions.data1.address, data))
+        # A CMD1 write which failed after reaching the device would run a non-idempotent command twice
+        yield ("transfer", writes, retry, False)
+        poll = [("read", register_definitions.command1.address, register_definitions.command1.size)]
+        if outdatalen > 0 and self.bus.combines_transfers:
+            # The Data1 readback rides along with every poll on the native bus, it is valid once CMD1 reads as completed
+            poll.append(("read", register_definitions.data1.address, outdatalen))
+        start = time.monotonic()
+        timeout += start
         successfull_reponse = [4, 0, 0, 0, 0]
         unrecognized_command_response = [4, 0x21, 0x43, 0x4D, 0x44]
-        while time.time() < timeout:
-            response = self.i2c_read(register_definitions.command1.address, register_definitions.command1.size, register_definitions.command1.name)
+        polls = 0
+        polling_key = command_polling.polling_key(command, data)
+        delays = self.polling.delays(polling_key)
+        now = start
+        while now < timeout:
+            outputs = yield ("transfer", poll, True, True)
+            response = outputs[0]
+            polls += 1
+            now = time.monotonic()
             if response == unrecognized_command_response:
                 print("4CC command rejected")
-                self.debug_i2c = holddebug
+                self.command_stats.record_failure(command, polls)
                 return None
             elif response == successfull_reponse:
                 if self.debug_4cc:
                     print("4CC Ack")
-                self.debug_i2c = holddebug
-                return self.i2c_read(register_definitions.data1.address, outdatalen, register_definitions.data1.name)
+                self.polling.record(polling_key, now - start)
+                self.command_stats.record(command, now - start, polls)
+                if len(outputs) > 1:
+                    return outputs[1]
+                outputs = yield ("transfer", [("read", register_definitions.data1.address, outdatalen)], True, False)
+                return outputs[0]
+            delay = min(next(delays), timeout - now)
+            if delay > 0:
+                yield ("sleep", delay)
+                now = time.monotonic()
         if outdatalen > 0:
             print("4CC Timeout")
-        self.debug_i2c = holddebug
+            self.command_stats.record_failure(command, polls)
         return None
 
     def check_status(self):
+        out = self.read_registers([register_definitions.global_system_configuration, register_definitions.boot_flags, register_definitions.firmware_version])
         print("Check GSC - (MSB.b15 - flash access locked)")
-        out = self.i2c_read(register_definitions.global_system_configuration.address, register_definitions.global_system_configuration.size, register_definitions.global_system_configuration.name)
-        print(lsbblock2hex(out))
+        print(lsbblock2hex(out[register_definitions.global_system_configuration.address]))
         print("Check Boot Flags - (b12,13 RegionCRCErr) (b7,6 RegionHeaderErr) (b3 - SPI present)")
-        out = self.i2c_read(register_definitions.boot_flags.address, register_definitions.boot_flags.size, register_definitions.boot_flags.name)
-        print(lsbblock2hex(out))
+        print(lsbblock2hex(out[register_definitions.boot_flags.address]))
         print("Check FW Version")
-        out = self.i2c_read(register_definitions.firmware_version.address, register_definitions.firmware_version.size, register_definitions.firmware_version.name)
-        print(lsbblock2hex(out))
+        print(lsbblock2hex(out[register_definitions.firmware_version.address]))
 
     def SimulateDisconnect4CC(self):
         if self.debug_4cc:
-            (f"4CC: simulate disconnect")
-        self.command_4CC("DISC", [2], 1, 3)
-
-    def SimulateDisconnect4CC(self):
-        if self.debug_4cc:
-            (f"4CC: simulate disconnect")
+            print("4CC: simulate disconnect")
         self.command_4CC("DISC", [2], 1, 3)
 
     def Resume4CC(self):
         if self.debug_4cc:
-            (f"4CC: resume operation")
+            print("4CC: resume operation")
         self.command_4CC("Gaid", [], 0, 0)
 
     def ColdReset4CC(self):
         if self.debug_4cc:
-            (f"4CC: cold reset")
-        self.command_4CC("GAID", [], 0, 0)
+            print("4CC: cold reset")
+        try:
+            self.command_4CC("GAID", [], 0, 0)
+        except (OSError, ValueError):
+            # The controller may reset before acknowledging the write, WaitReady(after_reset = True) observes the reboot
+            if self.debug_4cc:
+                print("GAID write not acknowledged")
+        # The configuration loaded after the reset may carry a different firmware patch
+        self.immutable_cache.clear()
 
-    def FlashRead4CC(self, addr):
+    def ReadMode(self):
+        # MODE register content ("BOOT", "PTCH", "APP "), None while the controller does not respond
+        return self.read_register_once(register_definitions.mode)
+
+    def ReadCommand(self):
+        # CMD1 register content, the 4CC in progress or zeros, None while the controller does not respond
+        return self.read_register_once(register_definitions.command1)
+
+    def read_register_once(self, register):
+        # A single attempt: NACKs are expected while the controller reboots and are not bus errors to recover from
+        try:
+            return bytes(self.i2c_read_once(register.address, register.size, register.name, quiet = True)[1 : 1 + register.size])
+        except (OSError, ValueError):
+            return None
+
+    def WaitReady(self, timeout = COLD_RESET_DELAY, after_reset = False):
+        # Poll MODE until the controller has left its boot loader, returns the seconds it took or None at the deadline
+        # After a cold reset the controller first has to go away, otherwise the old firmware could answer
+        # A controller which rebooted before the first poll answers with GAID gone from CMD1, its registers were reset
+        if after_reset:
+            self.register_cache.clear()
+        start = time.monotonic()
+        reset_observed = not after_reset
+        while not reset_observed and time.monotonic() - start < RESET_START_TIMEOUT:
+            reset_observed = self.ReadMode() in (None, b"BOOT") or self.ReadCommand() != b"GAID"
+            if not reset_observed:
+                time.sleep(READY_POLL_INTERVAL)
+        while True:
+            mode = self.ReadMode()
+            elapsed = time.monotonic() - start
+            if mode not in (None, b"BOOT"):
+                # The reboot time is unknown when the reset was not observed
+                if reset_observed and after_reset:
+                    self.reboot_times.append(elapsed)
+                elif after_reset:
+                    print(f"The cold reset was not observed within {RESET_START_TIMEOUT}s")
+                print(f"PD Controller ready after {elapsed:.2f}s in {mode.decode(errors = 'replace').strip()} mode")
+                self.ready = True
+                return elapsed
+            if elapsed > timeout:
+                print(f"PD Controller not ready after {timeout}s")
+                self.ready = False
+                return None
+            time.sleep(READY_POLL_INTERVAL)
+
+    def FlashRead4CC(self, addr, out = None):
+        # Fills the first 16 bytes of out when given, a new bytearray otherwise
         if self.debug_4cc:
-            (f"Read from Flash {hex(addr)}")
+            print(f"Read from Flash {hex(addr)}")
         dlen = 16
         data = self.command_4CC("FLrd", int32_to_bytes(addr), dlen)
-        return bytearray(data[-dlen:])
+        if data is None:
+            raise ValueError(f"Flash read at {hex(addr)} failed")
+        if out is None:
+            return bytearray(data[-dlen:])
+        out[:dlen] = bytes(data[-dlen:])
+        return out
+
+    def FlashReadRange(self, addr, length, out = None):
+        # Read length bytes starting at addr into out (a new bytearray by default) with as many 16 byte FLrd as needed
+        out = bytearray(length) if out is None else out
+        view = memoryview(out)
+        block = bytearray(16)
+        for block_addr in range(addr - addr % 16, addr + length, 16):
+            start = max(block_addr, addr)
+            end = min(block_addr + 16, addr + length)
+            if end - start == 16:
+                self.FlashRead4CC(block_addr, view[start - addr : end - addr])
+            else:
+                self.FlashRead4CC(block_addr, block)
+                view[start - addr : end - addr] = block[start - block_addr : end - block_addr]
+        view.release()
+        return out
 
     def FlashErase4CC(self, addr, sectors):
         if self.debug_4cc:
@@ -183,44 +657,69 @@ class TPS65988:
         code = self.command_4CC("FLem", int32_to_bytes(addr) + [sectors & 0xFF], 1, 10)
         return code
 
-    def FlashWrite4CC(self, addr, data):
+    def FlashSetAddress4CC(self, addr):
         if self.debug_4cc:
-            (f"Write Flash: {len(data)} bytes at {hex(addr)}")
-        codec = self.command_4CC("FLad", int32_to_bytes(addr), 1)
-        coded = self.command_4CC("FLwd", data, 1)
-        return coded
+            print(f"Set Flash address {hex(addr)}")
+        return self.command_4CC("FLad", int32_to_bytes(addr), 1)
+
+    def FlashWriteData4CC(self, data, addr = None):
+        # Flash address auto-increments by 64 bytes after each FLwd
+        # With the chunk address given a failed FLwd is retried after FLad, rewriting the same data is harmless
+        if self.debug_4cc:
+            print(f"Write Flash: {len(data)} bytes")
+        prepare = None if addr is None else lambda: self.FlashSetAddress4CC(addr)
+        return self.command_4CC("FLwd", data, 1, prepare = prepare)
+
+    def FlashWrite4CC(self, addr, data):
+        # The FLad code is returned when it failed, FLwd would write to the previously set address
+        code = self.FlashSetAddress4CC(addr)
+        if code != [0x40, 0]:
+            return code
+        return self.FlashWriteData4CC(data, addr)
+
+    def FlashCompare(self, addr, data):
+        # Compare flash content with data, stops reading at the first mismatching block
+        block = bytearray(16)
+        for offset in range(0, len(data), 16):
+            expected = data[offset : offset + 16]
+            if self.FlashRead4CC(addr + offset, block)[:len(expected)] != expected:
+                return False
+        return True
 
     def Print4CCRCode(self, code, prefix = ""):
         success_code = [0x40, 00]
-        res = "OK" if code == success_code else "Returned code: " + block2hex(code)
-        
-        if len(res) > 100:
-            with open("4CCRCode.txt", "a") as file:
-                file.write(res)
-            print("4CCRCode is longer than 100 characters and has been dumped into '4CCRCode.txt'.")
+        if code is None:
+            res = "No response"
         else:
+            res = "OK" if code == success_code else "Returned code: " + block2hex(code)
+        if code == success_code:
             print(res)
+            return
+        # The whole code goes to the progress stream, the console gets the first 100 characters
+        if self.metrics is not None:
+            self.metrics.event("4cc_error", operation = prefix, code = None if code is None else bytes(code).hex())
+        if len(res) > 100:
+            res = res[:100] + f"... ({len(code)} bytes)"
+        print(f"{prefix}: {res}" if prefix else res)
 
     def IsConfigured(self, debug_mode_enabled = False):
-        boot_flags_register_read_byte_count = 2
-        boot_flags_register_value = self.i2c_read(register_definitions.boot_flags.address, boot_flags_register_read_byte_count)
-        config_bytes = boot_flags_register_value[1:]
+        boot_flags = self.snapshot([register_definitions.boot_flags])[register_definitions.boot_flags.name]
 
-        spi_flash_present = is_bit_set(config_bytes[0], 3)
+        spi_flash_present = boot_flags["spi_flash_present"]
 
-        region0_read_attempt = is_bit_set(config_bytes[0], 4)
-        region1_read_attempt = is_bit_set(config_bytes[0], 5)
+        region0_read_attempt = boot_flags["region0_read_attempt"]
+        region1_read_attempt = boot_flags["region1_read_attempt"]
 
-        region0_header_invalid = is_bit_set(config_bytes[0], 6)
-        region1_header_invalid = is_bit_set(config_bytes[0], 7)
+        region0_header_invalid = boot_flags["region0_header_invalid"]
+        region1_header_invalid = boot_flags["region1_header_invalid"]
 
-        region0_read_invalid = is_bit_set(config_bytes[1], 0)
-        region1_read_invalid = is_bit_set(config_bytes[1], 1)
+        region0_read_invalid = boot_flags["region0_read_invalid"]
+        region1_read_invalid = boot_flags["region1_read_invalid"]
 
-        patch_download_error = is_bit_set(config_bytes[1], 2)
+        patch_download_error = boot_flags["patch_download_error"]
 
-        region0_crc_fail = is_bit_set(config_bytes[1], 4)
-        region1_crc_fail = is_bit_set(config_bytes[1], 5)
+        region0_crc_fail = boot_flags["region0_crc_fail"]
+        region1_crc_fail = boot_flags["region1_crc_fail"]
 
         if debug_mode_enabled:
             print(f"SPI flash present: {spi_flash_present}")
@@ -247,86 +746,457 @@ class TPS65988:
         return not patch_download_error
 
 
-if __name__ == "__main__":
-    args = initialize_argparse()
-    time.sleep(0.2)
-    print("Connecting to the TPS65988 chip...")
-    PDC = TPS65988(args.bus, use_ft230x = args.ft230x ,debug_i2c = args.verbose_i2c, debug_4cc = args.verbose_4cc)
+def run(PDC, args):
+    # Run the requested operations on a connected PD Controller, returns False when any of them failed
+    success = True
+    run_journal = create_journal(args)
+    metrics = station_metrics.StationMetrics(PDC, getattr(args, "board_label", PDC.transport), args.progress_fd)
+    PDC.metrics = metrics
+    # A session the daemon holds open was found ready by an earlier request, cold resets wait for the reboot themselves
+    if not PDC.ready and PDC.WaitReady(STARTUP_TIMEOUT) is None:
+        print("The PD Controller does not respond, nothing was done")
+        PDC.metrics = None
+        run_journal.close()
+        return False
     PDC.check_status()
     # PDC.Resume4CC()
 
+    if args.snapshot or args.snapshot_compare:
+        snapshot = {f"{addr:#04x}": PDC.snapshot(i2c_addr = addr) for addr in (PDC.i2c_addr1, PDC.i2c_addr2)}
+        if args.snapshot:
+            with open(args.snapshot, "w") as file:
+                json.dump(snapshot, file, indent = 1)
+            print(f"Register snapshot saved to {args.snapshot}")
+        if args.snapshot_compare:
+            with open(args.snapshot_compare) as file:
+                reference = json.load(file)
+            differences = register_definitions.diff_snapshots(reference, snapshot)
+            for path, expected, actual in differences:
+                print(f"{' / '.join(path)}: {expected} -> {actual}")
+            print(f"{len(differences)} register fields differ from {args.snapshot_compare}")
+
+    if args.monitor:
+        print(f"Monitoring {len(pd_monitor.monitored_registers)} registers on ports {PDC.i2c_addr1:#04x} and {PDC.i2c_addr2:#04x}, interrupt to stop")
+        series = pd_monitor.series_formats[args.monitor_format](args.monitor)
+        samples, changes, elapsed = pd_monitor.monitor(PDC, series, args.monitor_duration, args.monitor_interval)
+        print(f"{samples} samples in {elapsed:.1f}s ({samples / elapsed:.0f}/s), {changes} register changes saved to {args.monitor}")
+
     if args.debug_flash_config:
         postfix_when_invalid = (" not", "")[PDC.IsConfigured(args.debug_flash_config)]
         print(f"TPS65988 flash configuration is{postfix_when_invalid} valid.")
 
+    if args.identify:
+        known_images = catalog.Catalog(args.catalog)
+        changed = known_images.refresh()
+        if changed:
+            print(f"Catalog updated: {', '.join(changed)}")
+        probes = known_images.probe_addresses()
+        if not known_images.images:
+            print(f"No configuration binaries found in {args.catalog}, nothing to identify against")
+            success = False
+        else:
+            print(f"Identifying the configuration with {len(probes)} flash reads...")
+            name = known_images.identify(PDC.FlashRead4CC)
+            if name == catalog.BLANK:
+                print("The flash is erased")
+            elif name is not None:
+                # Only the probed blocks were read, a custom configuration differing elsewhere is not ruled out
+                print(f"The flash is consistent with {name} at all {len(probes)} probed blocks (sha256 {known_images.images[name]['sha256']})")
+            else:
+                print("The flash holds an unknown configuration")
+
     if args.dump:
-        memtop = 1024 * 1024
+        memtop = FLASH_SIZE
         if args.truncate:
             memtop = min(memtop, args.truncate * 1024)
-        print(f"Performing {int(memtop / 1024)}KB memory dump")
-        memidx = 0
-        memdump = []
-        while memidx < memtop:
-            if memidx % 0x1000 == 0:
-                percent = int(memidx * 100 / memtop)
-                print(f"Read from Flash {percent:02d}% - {hex(memidx)}", end="\r")
-            memdump.append(PDC.FlashRead4CC(memidx))
-            memidx += 16
-        print(f"{memtop} bytes read. Saving to {args.dump}")
-        with open(args.dump, "wb") as file:
-            for block in memdump:
-                file.write(block)
-        with open(args.dump + ".txt", "w") as file:
-            for block in memdump:
-                block = block2hex(block) + "\n"
-                file.write(block)
-
-    if args.erase:
-        memtop = 1024 * 1024
-        print(f"Performing {int(memtop / 1024)}KB memory ERASE")
-        sectors = int(memtop / (4 * 1024))
-        addr = 0
-        data = PDC.FlashErase4CC(addr, int(sectors / 2))
-        PDC.Print4CCRCode(data, f"Erase {hex(addr)}")
-        addr = int(memtop / 2)
-        data = PDC.FlashErase4CC(addr, int(sectors / 2))
-        PDC.Print4CCRCode(data, f"Erase {hex(addr)}")
+        dump_ranges = [(0, memtop)]
+        if args.smart_dump:
+            dump_ranges = [(start, min(end, memtop)) for start, end in flash_layout.merge_ranges(flash_layout.populated_ranges(PDC.FlashReadRange), 16) if start < memtop]
+        resume_offset = args.dump_offset
+        confirmed = run_journal.confirmed("dump")
+        if confirmed and not dump_consistent(PDC, args, confirmed[-1] - 16):
+            # Blocks of another board or another configuration must not be joined into one dump
+            print(f"Block {hex(confirmed[-1] - 16)} does not match {args.dump}, the journal was discarded and the dump starts over")
+            run_journal.reset()
+        elif confirmed:
+            resume_offset = max(resume_offset, confirmed[-1])
+            print(f"Resuming the dump from {hex(resume_offset)} recorded in {args.journal}")
+        output = flash_dump.DumpWriter(args.dump, args.dump_format, resume_offset)
+        dump_ranges = [(max(start, output.resume_offset), end) for start, end in dump_ranges if end > output.resume_offset]
+        dump_size = sum(end - start for start, end in dump_ranges)
+        print(f"Performing {int(dump_size / 1024)}KB memory dump from {hex(output.resume_offset)}")
+        read = 0
+        block = bytearray(16)
+        metrics.start("dump", dump_size)
+        for memidx, range_end in dump_ranges:
+            while memidx < range_end:
+                metrics.progress(read, memidx)
+                output.write(memidx, PDC.FlashRead4CC(memidx, block))
+                memidx += 16
+                read += 16
+                if memidx % FLASH_SECTOR_SIZE == 0 or memidx == range_end:
+                    output.flush()
+                    run_journal.confirm("dump", memidx)
+        output.close()
+        metrics.end(True, read)
+        print(f"{dump_size} bytes read. Saved to {args.dump}")
+
+    if args.erase and run_journal.done("erase"):
+        print(f"Erase already completed according to {args.journal}")
+    elif args.erase:
+        erase_ranges = [(0, FLASH_SIZE)]
+        if args.erase_range:
+            erase_ranges = [parse_range(args.erase_range)]
+        elif args.write:
+            # Erasing the sectors covered by the image clears the region pointers as well
+            image_size = os.path.getsize(args.write)
+            if args.truncate:
+                image_size = min(image_size, args.truncate * 1024)
+            erase_ranges = [(0, min(FLASH_SIZE, image_size))]
+        plan = plan_erase(erase_ranges)
+        memtop = sum(sectors for addr, sectors in plan) * FLASH_SECTOR_SIZE
+        print(f"Performing {int(memtop / 1024)}KB memory ERASE with {len(plan)} FLem commands")
+        metrics.start("erase", memtop)
+        erased = 0
+        for addr, sectors in plan:
+            metrics.progress(erased, addr)
+            data = PDC.FlashErase4CC(addr, sectors)
+            PDC.Print4CCRCode(data, f"Erase {hex(addr)}")
+            success = success and data == [0x40, 0]
+            erased += sectors * FLASH_SECTOR_SIZE
+        metrics.end(success, erased)
         print("Performing cold reset")
-        code = PDC.ColdReset4CC()
-        time.sleep(5)
+        PDC.ColdReset4CC()
+        PDC.WaitReady(after_reset = True)
+        if success:
+            run_journal.confirm("erase")
 
     if args.write:
-        if not args.force and PDC.IsConfigured():
+        # A resumed write has passed this check before it started writing
+        resumed = run_journal.done("write")
+        confirmed = run_journal.confirmed("write")
+        if not args.force and not args.diff and not resumed and PDC.IsConfigured():
             print("TPS65988 is already configured. Aborting...")
+            success = False
+        elif confirmed and not journal_consistent(PDC, args.write, confirmed[-1], args.truncate):
+            # Nothing is written, confirmed or reset on a journal which does not describe the flash
+            print(f"Sector {hex(confirmed[-1])} does not match {args.journal}, the journal was discarded and nothing was written")
+            print("The next run starts over")
+            run_journal.reset()
+            success = False
         else:
-            with open(args.write, "rb") as file:
-                data = file.read()
-            data = list(data) + [0] * (len(data) % 64)  # padding
-            memtop = min(1024 * 1024, len(data))
-            if args.truncate:
-                memtop = min(memtop, args.truncate * 1024)
-            print(f"Writing {int(memtop / 1024)}KB to flash memory...")
-            memidx = 0
-            memdump = []
-            success = True
-            flash_write_successfull_code = [0x40, 0]
-
-            while memidx < memtop:
-                if memidx % 0x100 == 0:
-                    percent = int(memidx * 100 / memtop)
-                    print(f"Writing flash {percent:02d}% - {hex(memidx)}", end="\r")                   
-                if len([x for x in data[memidx : memidx + 64] if x<0xFF]):
-                    code = PDC.FlashWrite4CC(memidx, data[memidx : memidx + 64])
-                if not code == flash_write_successfull_code:
-                    PDC.Print4CCRCode(data, f"Write {hex(memidx)}")
-                    success = False
-                memidx += 64
+            with flash_image.FlashImage(args.write) as image:
+                memtop = min(FLASH_SIZE, len(image))
+                if args.truncate:
+                    memtop = min(memtop, args.truncate * 1024)
+                write_ranges = [(0, memtop)]
+                if confirmed:
+                    print(f"Resuming the write, {len(confirmed)} sectors confirmed in {args.journal}")
+                    write_ranges = exclude_sectors(write_ranges, set(confirmed))
+                if args.diff:
+                    write_ranges = plan_diff(PDC, image, memtop, set(confirmed))
+                    print(f"{len(write_ranges)} of {-(-memtop // FLASH_SECTOR_SIZE)} sectors differ from the image")
+                    for addr, sectors in plan_erase(write_ranges):
+                        code = PDC.FlashErase4CC(addr, sectors)
+                        PDC.Print4CCRCode(code, f"Erase {hex(addr)}")
+                        success = success and code == [0x40, 0]
+                write_plan = headers_last(image, plan_write(image, write_ranges), memtop)
+                if resumed and not args.diff and write_plan:
+                    # Sectors left unconfirmed may hold partially programmed chunks
+                    for addr, sectors in plan_erase(write_plan):
+                        code = PDC.FlashErase4CC(addr, sectors)
+                        PDC.Print4CCRCode(code, f"Erase {hex(addr)}")
+                        success = success and code == [0x40, 0]
+                # A sector is confirmed in the journal once its last planned chunk is written
+                last_chunks = {}
+                for run_start, run_end in write_plan:
+                    for memidx in range(run_start, run_end, FLASH_WRITE_SIZE):
+                        last_chunks[memidx - memidx % FLASH_SECTOR_SIZE] = memidx
+                failed_sectors = set()
+                run_journal.confirm("write")
+                memtop = sum(end - start for start, end in write_plan)
+                chunks = memtop // FLASH_WRITE_SIZE
+                print(f"Writing {int(memtop / 1024)}KB to flash memory in {len(write_plan)} runs: {len(write_plan) + chunks} 4CC commands ({len(write_plan)} FLad, {chunks} FLwd)...")
+                write_success = True
+                flash_write_successfull_code = [0x40, 0]
+
+                written = 0
+                metrics.start("write", memtop)
+                for run_start, run_end in write_plan:
+                    code = PDC.FlashSetAddress4CC(run_start)
+                    if not code == flash_write_successfull_code:
+                        PDC.Print4CCRCode(code, f"Set address {hex(run_start)}")
+                        write_success = False
+                        failed_sectors.update(range(run_start - run_start % FLASH_SECTOR_SIZE, run_end, FLASH_SECTOR_SIZE))
+                        continue
+                    for memidx in range(run_start, run_end, FLASH_WRITE_SIZE):
+                        metrics.progress(written, memidx)
+                        code = PDC.FlashWriteData4CC(image.read(memidx, FLASH_WRITE_SIZE), memidx)
+                        sector = memidx - memidx % FLASH_SECTOR_SIZE
+                        if not code == flash_write_successfull_code:
+                            PDC.Print4CCRCode(code, f"Write {hex(memidx)}")
+                            write_success = False
+                            failed_sectors.add(sector)
+                        elif last_chunks[sector] == memidx and sector not in failed_sectors:
+                            run_journal.confirm("write", sector)
+                        written += FLASH_WRITE_SIZE
+            metrics.end(write_success, written)
             print(f"Write completed {memtop} bytes written")
-            if success:
+            success = success and write_success
+            if write_success:
                 print("The PD Controller has been flashed successfully")
             else:
                 print("Flashing PD Controller failed.")
             print("Performing cold reset")
-            code = PDC.ColdReset4CC()
+            PDC.ColdReset4CC()
+            PDC.WaitReady(after_reset = True)
+
+    if args.verify:
+        with flash_image.FlashImage(args.verify) as image:
+            memtop = min(FLASH_SIZE, len(image))
+            if args.truncate:
+                memtop = min(memtop, args.truncate * 1024)
+            verified = True
+            checked = "Flash content matches the image"
+            if args.verify_mode == "boot_flags":
+                # The Boot Flags CRC check only vouches for the patch data, everything else of the regions is compared
+                verified = regions_match(PDC, image, memtop)
+                if not verified:
+                    print(f"The region pointers, headers or configuration sections do not match {args.verify}")
+                else:
+                    print("Performing cold reset")
+                    PDC.ColdReset4CC()
+                    PDC.WaitReady(after_reset = True)
+                    verified = PDC.IsConfigured(args.debug_flash_config)
+                    print(f"Boot Flags report the configuration as {('invalid', 'valid')[verified]}")
+                    checked = "Region pointers, headers and configuration sections match the image and Boot Flags report the patch CRCs of the loaded regions as valid"
+            if args.verify_mode == "readback" or not verified:
+                checked = "Flash content matches the image"
+                # Only the chunks which were written have to be read back
+                verify_ranges = plan_write(image, [(0, memtop)])
+                verify_size = sum(end - start for start, end in verify_ranges)
+                print(f"Verifying {int(verify_size / 1024)}KB of flash memory...")
+                metrics.start("verify", verify_size)
+                expected = flash_layout.sector_crcs(image.read, verify_ranges)
+                def read_back(addr, length):
+                    data = PDC.FlashReadRange(addr, length)
+                    metrics.progress(metrics.done + length, addr)
+                    return data
+                actual = flash_layout.sector_crcs(read_back, verify_ranges)
+                mismatches = [sector for sector in expected if expected[sector] != actual[sector]]
+                metrics.end(not mismatches, verify_size)
+                for sector in mismatches:
+                    print(f"Sector {hex(sector)} does not match {args.verify}")
+                verified = not mismatches
+        success = success and verified
+        if verified:
+            print(checked)
+        else:
+            print("Flash verification failed.")
+
+    if any(PDC.retry_counts.values()):
+        print(f"Retried {PDC.retry_counts['transaction']} I2C transactions and {PDC.retry_counts['4cc']} 4CC commands, {PDC.retry_counts['bus_recovery']} bus recoveries")
+
+    if args.latency_stats:
+        PDC.command_stats.print_summary()
+
+    if args.trace:
+        PDC.tracer.export_jsonl(args.trace)
+    if args.trace_chrome:
+        PDC.tracer.export_chrome(args.trace_chrome)
+
+    if args.metrics_textfile:
+        metrics.write_textfile(args.metrics_textfile, success)
+    PDC.metrics = None
+
+    if success:
+        run_journal.complete()
+    else:
+        run_journal.close()
+    return success
+
+
+def analyze_image(path):
+    # Offline report of the image layout, returns the problems found
+    with flash_image.FlashImage(path) as image:
+        size = min(FLASH_SIZE, len(image))
+        checks, problems = flash_layout.check_image(image.read, size)
+        print(f"{path}: {image.length} bytes")
+        for check in checks:
+            if check.header_invalid:
+                print(f"Region {check.region}: no valid header")
+                continue
+            sections = ", ".join([f"{name} {hex(start)}-{hex(end)}" for name, start, end in flash_layout.region_sections(check.header)])
+            status = "reaches past the image end" if check.read_invalid else f"CRC {('OK', 'FAIL')[check.crc_fail]}"
+            print(f"Region {check.region}: {sections}, {status}")
+        occupied = flash_layout.populated_ranges(image.read)
+        print(f"Occupied {sum(end - start for start, end in occupied)} bytes: {' '.join([f'{hex(start)}-{hex(end)}' for start, end in occupied])}")
+    for problem in problems:
+        print(problem)
+    return problems
+
 
-    PDC.bus.close()
\ No newline at end of file
+def regions_match(PDC, image, memtop):
+    # Compare the region pointers, header offset words, region headers (patch data CRC included) and the configuration
+    # sections, which no CRC covers, with the image
+    image_read = lambda addr, length: image.read(addr, length, memtop)
+    ranges = []
+    for pointer in flash_layout.region_pointers:
+        ranges += [(pointer.pointer_address, pointer.pointer_address + 4), (pointer.offset_address, pointer.offset_address + 4)]
+    for region in range(len(flash_layout.region_pointers)):
+        header = flash_layout.read_region_header(image_read, region)
+        if header is not None:
+            ranges += [(start, min(end, memtop)) for name, start, end in flash_layout.region_sections(header) if name != "patch" and start < memtop]
+    return all(PDC.FlashCompare(start, image_read(start, end - start)) for start, end in ranges)
+
+
+def check_images(args):
+    # Refuse invalid --write/--verify images before connecting to any board
+    if args.skip_image_check:
+        return True
+    valid = True
+    for path in {args.write, args.verify} - {None}:
+        with flash_image.FlashImage(path) as image:
+            checks, problems = flash_layout.check_image(image.read, min(FLASH_SIZE, len(image)))
+        for problem in problems:
+            print(f"{path}: {problem}")
+        valid = valid and not problems
+    if not valid:
+        print("The image would not load on the PD Controller, use --skip_image_check to flash it anyway")
+    return valid
+
+
+def journal_consistent(PDC, path, sector, truncate = None):
+    # Quick consistency check of a resumed write: the last confirmed sector has to still hold the image
+    with flash_image.FlashImage(path) as image:
+        memtop = min(FLASH_SIZE, len(image))
+        if truncate:
+            memtop = min(memtop, truncate * 1024)
+        expected = bytes(image.read(sector, FLASH_SECTOR_SIZE, memtop))
+    return PDC.FlashCompare(sector, expected)
+
+
+def dump_consistent(PDC, args, addr):
+    # Quick consistency check of a resumed dump: the last confirmed block has to still hold what was saved
+    saved = flash_dump.read_block(args.dump, args.dump_format, addr)
+    return saved is not None and len(saved) == 16 and PDC.FlashRead4CC(addr) == saved
+
+
+def create_tracer(args):
+    # Tracing costs nothing unless one of the trace outputs is requested
+    if args.trace or args.trace_chrome:
+        return tracing.Tracer(args.trace_size)
+    return None
+
+
+def create_journal(args):
+    # Journal of the run, disabled without --journal; any change to the job options or images starts a new one
+    if not args.journal:
+        return journal.Journal(None, {})
+    job = {option: getattr(args, option) for option in ("dump", "dump_format", "smart_dump", "erase", "erase_range", "write", "truncate", "diff")}
+    if args.write:
+        job["write_sha256"] = journal.file_sha256(args.write)
+    return journal.Journal(args.journal, job)
+
+
+def run_target(target, args):
+    # Connect to a single board of a --targets run, output files get the board label inserted before their extension
+    # (metrics.prom becomes metrics-<label>.prom, node_exporter only collects *.prom files)
+    board_args = argparse.Namespace(**vars(args))
+    for output in ("snapshot", "monitor", "dump", "journal", "trace", "trace_chrome", "metrics_textfile"):
+        if getattr(args, output):
+            base, extension = os.path.splitext(getattr(args, output))
+            setattr(board_args, output, f"{base}-{target.label}{extension}")
+    board_args.board_label = target.label
+    print("Connecting to the TPS65988 chip...")
+    PDC = TPS65988(target.bus_no, use_ft230x = target.ftdi_addr is not None, transport = None if target.ftdi_addr else args.transport, debug_i2c = args.verbose_i2c, debug_4cc = args.verbose_4cc, polling = args.polling, ftdi_addr = target.ftdi_addr, tracer = create_tracer(args), retries = args.retries, command_retries = args.command_retries, keep_gpio = args.ft230x_keep_gpio, calibrate = args.ft230x_calibrate)
+    try:
+        return run(PDC, board_args)
+    finally:
+        PDC.bus.close()
+
+
+# Options holding file paths, made absolute before they are sent to the daemon
+path_options = ("catalog", "snapshot", "snapshot_compare", "monitor", "dump", "write", "verify", "journal", "trace", "trace_chrome", "metrics_textfile")
+
+
+def device_key(args):
+    # "ftdi://..." for FT230X adapters, "busN" for the native bus, "transport:N" for other transports
+    if args["ft230x"] or args["transport"] == "ft230x":
+        return args["ftdi_addr"]
+    if args["transport"] not in (None, "smbus"):
+        return f"{args['transport']}:{args['bus']}"
+    return f"bus{args['bus']}"
+
+
+def serve_daemon(args):
+    # Sessions are opened on the first request for a board and stay open until the daemon stops
+    def connect(key):
+        if key.startswith("ftdi://"):
+            return TPS65988(None, use_ft230x = True, debug_i2c = False, polling = args.polling, ftdi_addr = key, retries = args.retries, command_retries = args.command_retries, cache_ttl = args.cache_ttl, keep_gpio = args.ft230x_keep_gpio, calibrate = args.ft230x_calibrate)
+        if ":" in key:
+            transport, bus_no = key.split(":")
+            return TPS65988(int(bus_no), transport = transport, debug_i2c = False, polling = args.polling, retries = args.retries, command_retries = args.command_retries, cache_ttl = args.cache_ttl)
+        return TPS65988(int(key[len("bus"):]), debug_i2c = False, polling = args.polling, retries = args.retries, command_retries = args.command_retries, cache_ttl = args.cache_ttl)
+
+    def handle(PDC, request):
+        request_args = argparse.Namespace(**request)
+        PDC.debug_i2c = request_args.verbose_i2c
+        PDC.debug_4cc = request_args.verbose_4cc
+        PDC.tracer = create_tracer(request_args)
+        PDC.retries = request_args.retries
+        PDC.command_retries = request_args.command_retries
+        PDC.retry_counts = dict.fromkeys(PDC.retry_counts, 0)
+        PDC.command_stats = command_polling.CommandStats()
+        return run(PDC, request_args)
+
+    server = flash_daemon.Daemon(args.daemon, connect, handle, device_key, args.socket_mode)
+    print(f"Serving requests on {args.daemon} (mode {args.socket_mode:03o})")
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+def send_to_daemon(args):
+    request = vars(args)
+    for option in path_options:
+        if request[option]:
+            request[option] = os.path.abspath(request[option])
+    if request["progress_fd"] is not None:
+        # The descriptor belongs to this process, the daemon cannot write to it
+        print("--progress_fd is not available with --socket, the progress is printed instead")
+        request["progress_fd"] = None
+    return flash_daemon.send_request(args.socket, request)
+
+
+if __name__ == "__main__":
+    args = initialize_argparse()
+    if args.analyze:
+        exit(1 if analyze_image(args.analyze) else 0)
+    if not args.daemon and not check_images(args):
+        exit(1)
+    if args.daemon:
+        serve_daemon(args)
+        exit(0)
+    if args.socket:
+        if args.targets:
+            print("--targets cannot be combined with --socket, send one request per board")
+            exit(1)
+        exit(0 if send_to_daemon(args) else 1)
+    if args.targets:
+        targets = [multi_board.parse_target(target) for target in args.targets]
+        if (args.ft230x or args.transport == "ft230x") and any(target.ftdi_addr is None for target in targets):
+            # A bus number does not select an FT230X adapter
+            print("--targets with --ft230x takes FT230X URLs (ftdi://...) only, not I2C bus numbers")
+            exit(1)
+        results = multi_board.run_boards(targets, lambda target: run_target(target, args), args.jobs)
+        multi_board.print_report(results)
+        exit(0 if all(result.success for result in results) else 1)
+    print("Connecting to the TPS65988 chip...")
+    PDC = TPS65988(args.bus, use_ft230x = args.ft230x, transport = args.transport, ftdi_addr = args.ftdi_addr, debug_i2c = args.verbose_i2c, debug_4cc = args.verbose_4cc, polling = args.polling, tracer = create_tracer(args), retries = args.retries, command_retries = args.command_retries, keep_gpio = args.ft230x_keep_gpio, calibrate = args.ft230x_calibrate)
+    try:
+        success = run(PDC, args)
+    finally:
+        PDC.bus.close()
+    exit(0 if success else 1)
\ No newline at end of file
@@ -0,0 +1,138 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# asyncio front end of a TPS65988 for supervising many boards from a single event loop
+# Bus transfers run in an executor, waiting for 4CC completion yields to the event loop
+#
+#   PDC = AsyncTPS65988(TPS65988_flash.TPS65988(bus_no, debug_i2c = False))
+#   code = await PDC.FlashErase4CC(0x0, 1)
+
+import time
+import asyncio
+import functools
+import register_definitions
+from TPS65988_flash import int32_to_bytes
+
+SUCCESS_CODE = [0x40, 0]
+
+
+class AsyncTPS65988:
+    def __init__(self, device, executor = None):
+        # device is a connected TPS65988, executor None uses the event loop default executor
+        self.device = device
+        self.executor = executor
+        # Commands of one board never overlap, boards do
+        self.lock = asyncio.Lock()
+
+    async def offload(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(function, *args))
+
+    async def transfer(self, operations, retry = True, quiet = False):
+        return await self.offload(self.device.i2c_transfer, operations, retry, quiet)
+
+    async def command_4CC(self, command, data, outdatalen, timeout = 1, prepare = None):
+        # prepare is a coroutine function run without taking the lock again
+        async with self.lock:
+            return await self.attempt_command_4CC(command, data, outdatalen, timeout, prepare)
+
+    async def attempt_command_4CC(self, command, data, outdatalen, timeout = 1, prepare = None):
+        # Retries follow TPS65988.command_4CC_attempts, the caller holds the lock
+        attempts = self.device.command_4CC_attempts(command, outdatalen, prepare is not None)
+        try:
+            step = next(attempts)
+            while True:
+                if step[0] == "prepare":
+                    step = attempts.send(await prepare())
+                elif step[0] == "recover":
+                    await self.offload(self.device.recover_bus)
+                    step = next(attempts)
+                else:
+                    try:
+                        output = await self.run_command_4CC(command, data, outdatalen, timeout, step[1])
+                    except (OSError, ValueError) as e:
+                        step = attempts.throw(e)
+                    else:
+                        step = attempts.send(output)
+        except StopIteration as stop:
+            return stop.value
+
+    async def run_command_4CC(self, command, data, outdatalen, timeout, retry = True):
+        # Perform the TPS65988 command steps, sleeping between polls on the event loop
+        device = self.device
+        device.command = command
+        trace_start = time.perf_counter() if device.tracer is not None else 0
+        output = None
+        steps = device.command_4CC_steps(command, data, outdatalen, timeout, retry)
+        try:
+            step = next(steps)
+            while True:
+                if step[0] == "sleep":
+                    await asyncio.sleep(step[1])
+                    step = next(steps)
+                else:
+                    step = steps.send(await self.transfer(*step[1:]))
+        except StopIteration as stop:
+            output = stop.value
+        finally:
+            if device.tracer is not None:
+                device.trace("4cc", trace_start, register_definitions.command1.address, len(data), output is not None)
+            device.command = None
+        return output
+
+    async def FlashRead4CC(self, addr, out = None):
+        if self.device.debug_4cc:
+            print(f"Read from Flash {hex(addr)}")
+        dlen = 16
+        data = await self.command_4CC("FLrd", int32_to_bytes(addr), dlen)
+        if data is None:
+            raise ValueError(f"Flash read at {hex(addr)} failed")
+        if out is None:
+            return bytearray(data[-dlen:])
+        out[:dlen] = bytes(data[-dlen:])
+        return out
+
+    async def FlashErase4CC(self, addr, sectors):
+        if self.device.debug_4cc:
+            print(f"Erase Flash from {hex(addr)} -> {sectors}*4K")
+        return await self.command_4CC("FLem", int32_to_bytes(addr) + [sectors & 0xFF], 1, 10)
+
+    async def FlashSetAddress4CC(self, addr):
+        if self.device.debug_4cc:
+            print(f"Set Flash address {hex(addr)}")
+        return await self.command_4CC("FLad", int32_to_bytes(addr), 1)
+
+    async def FlashWriteData4CC(self, data, addr = None):
+        # With the chunk address given a failed FLwd is retried after FLad, as in TPS65988.FlashWriteData4CC
+        if self.device.debug_4cc:
+            print(f"Write Flash: {len(data)} bytes")
+        prepare = None
+        if addr is not None:
+            prepare = lambda: self.attempt_command_4CC("FLad", int32_to_bytes(addr), 1)
+        return await self.command_4CC("FLwd", data, 1, prepare = prepare)
+
+    async def FlashWrite4CC(self, addr, data):
+        # The FLad code is returned when it failed, FLwd would write to an unknown address
+        code = await self.FlashSetAddress4CC(addr)
+        if code != SUCCESS_CODE:
+            return code
+        return await self.FlashWriteData4CC(data, addr)
+
+    async def IsConfigured(self, debug_mode_enabled = False):
+        # A few register reads, run in the executor as a whole
+        async with self.lock:
+            return await self.offload(self.device.IsConfigured, debug_mode_enabled)
+
+    async def check_status(self):
+        async with self.lock:
+            return await self.offload(self.device.check_status)
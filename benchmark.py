@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measure flashing throughput against simulated TPS65988 devices, no hardware needed
+
+import os
+import io
+import glob
+import time
+import argparse
+import tempfile
+import contextlib
+import ft230x
+import simulator
+import TPS65988_flash
+
+
+def initialize_argparse():
+    parser = argparse.ArgumentParser(description="Benchmark dump/erase/write against a simulated PD Controller.")
+    parser.add_argument("--images", nargs="+", default=sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "tps-config-binaries", "*.bin"))), help="Configuration binaries")
+    parser.add_argument("--transports", nargs="+", choices=["smbus", "ft230x"], default=["smbus", "ft230x"], help="Simulated transports")
+    parser.add_argument("--operations", nargs="+", choices=["dump", "erase", "write"], default=["dump", "erase", "write"], help="Benchmarked operations")
+    parser.add_argument("--truncate", type=int, default=64, help="Limit dump to TRUNCATE Kbytes")
+    parser.add_argument("--transaction_latency", type=float, default=0, help="Simulated I2C transaction latency in seconds")
+    parser.add_argument("--usb_latency", type=float, default=0, help="Simulated FT230X USB operation latency in seconds")
+    parser.add_argument("--error_rate", type=float, default=0, help="Share of I2C addressing attempts the simulated device does not acknowledge")
+    parser.add_argument("--options", nargs=argparse.REMAINDER, default=[], help="Extra TPS65988_flash.py arguments")
+    return parser.parse_args()
+
+
+def connect(transport, device, args):
+    if transport == "smbus":
+        bus = simulator.SimulatedSMBus(device)
+        return TPS65988_flash.TPS65988(None, debug_i2c = False, bus = bus), bus
+    ftdi = simulator.SimulatedFtdi(device, usb_latency = args.usb_latency)
+    return TPS65988_flash.TPS65988(None, use_ft230x = True, debug_i2c = False, bus = ft230x.cbusBitBang(ftdi = ftdi)), ftdi
+
+
+def benchmark(transport, image_path, operation, args, workdir):
+    # Returns (bytes, seconds, 4CC commands, bus transactions, I2C_RDWR ioctls or USB operations, success)
+    with open(image_path, "rb") as file:
+        image = file.read()
+    # Dumps read a configured board, erase and write start from a blank one
+    device = simulator.SimulatedTPS65988(image if operation == "dump" else b"", transaction_latency = args.transaction_latency, error_rate = args.error_rate)
+    PDC, link = connect(transport, device, args)
+    options = {
+        "dump": ["--dump", os.path.join(workdir, "dump"), "--dump_format", "raw", "--truncate", str(args.truncate)],
+        "erase": ["--erase", "--erase_range", f"0:{len(image) + -len(image) % TPS65988_flash.FLASH_SECTOR_SIZE:#x}"],
+        "write": ["--write", image_path, "--force"],
+    }[operation]
+    run_args = TPS65988_flash.initialize_argparse(options + args.options)
+    commands = sum(device.commands.values())
+    transactions = device.transactions
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.monotonic()
+        success = TPS65988_flash.run(PDC, run_args)
+        duration = time.monotonic() - start
+    size = {
+        "dump": min(args.truncate * 1024, TPS65988_flash.FLASH_SIZE),
+        "erase": len(image),
+        "write": len(image),
+    }[operation]
+    if operation == "write":
+        success = success and device.flash[:len(image)] == image
+    return size, duration, sum(device.commands.values()) - commands, device.transactions - transactions, link.submissions if transport == "smbus" else link.usb_ops, success
+
+
+if __name__ == "__main__":
+    args = initialize_argparse()
+    print("Transport Image              Operation       Bytes   Time[s]    Bytes/s    4CC  Transactions  ioctls/USB ops  Result")
+    with tempfile.TemporaryDirectory() as workdir:
+        for transport in args.transports:
+            for image_path in args.images:
+                for operation in args.operations:
+                    size, duration, commands, transactions, usb_ops, success = benchmark(transport, image_path, operation, args, workdir)
+                    print(f"{transport:9s} {os.path.basename(image_path):18s} {operation:9s} {size:11d} {duration:9.2f} {size / duration:10.0f} {commands:6d} {transactions:13d} {usb_ops:14d}  {'OK' if success else 'FAIL'}")
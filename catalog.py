@@ -0,0 +1,146 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import glob
+import json
+import hashlib
+import flash_layout
+
+BLOCK_SIZE = 16  # bytes returned by a single FLrd
+CONFIRMATION_PROBES = 8  # extra blocks read to tell custom images from catalog ones
+HEADER_CRC_OFFSET = 0x10  # patch data CRC word within a region header
+BLANK = "blank"
+CATALOG_VERSION = 3
+CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "tps65988_flash")
+
+
+def image_block(image, addr):
+    # Flash block of an image, space past the image end is erased
+    return bytes(image[addr : addr + BLOCK_SIZE]).ljust(BLOCK_SIZE, b"\xff")
+
+
+class Catalog:
+    # Index of the known configuration binaries with the flash blocks which tell them apart
+    def __init__(self, directory, path = None):
+        # The index is cached per binaries directory in the user cache, the directory itself may be read-only
+        self.directory = directory
+        self.path = path or os.path.join(CACHE_DIRECTORY, "catalog-" + hashlib.sha256(os.path.abspath(directory).encode()).hexdigest()[:16] + ".json")
+        self.images = {}
+        self.probes = {}
+        try:
+            with open(self.path) as file:
+                catalog = json.load(file)
+        except (OSError, ValueError):
+            catalog = {}
+        if catalog.get("version") == CATALOG_VERSION:
+            self.images = catalog["images"]
+            self.probes = catalog["probes"]
+
+    def save(self):
+        # The cache is only an optimization, the index is rebuilt on the next run when it cannot be stored
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok = True)
+            with open(self.path, "w") as file:
+                json.dump({"version": CATALOG_VERSION, "images": self.images, "probes": self.probes}, file, indent=1)
+        except OSError as e:
+            print(f"Catalog index not cached: {e}")
+
+    def refresh(self):
+        # Index new or modified binaries only, returns the names of the changed entries
+        changed = []
+        found = {}
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.bin"))):
+            name = os.path.basename(path)
+            stat = os.stat(path)
+            entry = self.images.get(name)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+                with open(path, "rb") as file:
+                    image = file.read()
+                read = lambda addr, length: image[addr : addr + length]
+                entry = {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "sha256": hashlib.sha256(image).hexdigest(),
+                    "sectors": {str(sector): crc for sector, crc in flash_layout.sector_crcs(read, [(0, len(image))]).items()},
+                }
+                changed.append(name)
+            found[name] = entry
+        changed += [name for name in self.images if name not in found]
+        self.images = found
+        if changed or not self.probes:
+            self.select_probes()
+            self.save()
+        return changed
+
+    def select_probes(self):
+        # Greedily pick blocks until every pair of images (and a blank flash) differs in at least one of them
+        images = {BLANK: b""}
+        for name in self.images:
+            with open(os.path.join(self.directory, name), "rb") as file:
+                images[name] = file.read()
+        top = max(len(image) for image in images.values())
+        blank_sectors = flash_layout.sector_crcs(lambda addr, length: b"\xff" * length, [(0, top)])
+
+        # Only sectors whose CRC differs between the images can hold distinguishing blocks
+        candidates = []
+        for sector in range(0, top, flash_layout.FLASH_SECTOR_SIZE):
+            crcs = {entry["sectors"].get(str(sector), blank_sectors[sector]) for entry in self.images.values()}
+            if len(crcs | {blank_sectors[sector]}) > 1:
+                candidates += range(sector, min(sector + flash_layout.FLASH_SECTOR_SIZE, top), BLOCK_SIZE)
+
+        # Trailing erased bytes are not told apart from the erased flash past the image end
+        names = sorted(images)
+        contents = {name: bytes(image).rstrip(b"\xff") for name, image in images.items()}
+        unresolved = {(a, b) for a in names for b in names if a < b and contents[a] != contents[b]}
+        probes = set()
+        while unresolved:
+            resolves = lambda addr: len([pair for pair in unresolved if image_block(images[pair[0]], addr) != image_block(images[pair[1]], addr)])
+            best = max(candidates, key = resolves, default = None)
+            if best is None or not resolves(best):
+                break
+            probes.add(best)
+            unresolved = {pair for pair in unresolved if image_block(images[pair[0]], best) == image_block(images[pair[1]], best)}
+        for a, b in sorted(unresolved | {(a, b) for a in names for b in names if a < b and contents[a] == contents[b]}):
+            print(f"{b} cannot be told apart from {a} in flash, it is identified as {a}")
+
+        # Region headers (magic, patch data CRC and configuration section words) and a spread of populated blocks
+        # catch images missing from the catalog
+        populated = set()
+        for name, image in images.items():
+            read = lambda addr, length: image[addr : addr + length].ljust(length, b"\xff")
+            for region in range(len(flash_layout.region_pointers)):
+                header = flash_layout.read_region_header(read, region)
+                if header is not None:
+                    probes.update(addr - addr % BLOCK_SIZE for addr in (header.address, header.address + HEADER_CRC_OFFSET, header.address + flash_layout.CONFIG_SECTION_WORDS))
+            populated.update(addr for addr in range(0, len(image), BLOCK_SIZE) if image_block(image, addr) != b"\xff" * BLOCK_SIZE)
+        populated = sorted(populated - probes)
+        probes.update(populated[idx * len(populated) // CONFIRMATION_PROBES] for idx in range(min(CONFIRMATION_PROBES, len(populated))))
+
+        self.probes = {name: {str(addr): image_block(images[name], addr).hex() for addr in sorted(probes)} for name in names}
+
+    def probe_addresses(self):
+        return sorted({int(addr) for blocks in self.probes.values() for addr in blocks})
+
+    def identify(self, read_block):
+        # Name of the catalog image (or BLANK) matching all probed blocks, None for an unknown configuration
+        # or when there is nothing to probe
+        addresses = self.probe_addresses()
+        if not addresses:
+            return None
+        blocks = {str(addr): bytes(read_block(addr)).hex() for addr in addresses}
+        for name, expected in self.probes.items():
+            if expected == blocks:
+                return name
+        return None
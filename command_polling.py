@@ -0,0 +1,114 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+class BusyPolling:
+    # Poll CMD1 back to back
+    def delays(self, command):
+        while True:
+            yield 0
+
+    def record(self, command, latency):
+        pass
+
+
+class ExponentialPolling:
+    # First poll immediately, then back off exponentially up to the maximum interval
+    def __init__(self, initial = 0.0005, factor = 2, maximum = 0.02):
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+
+    def delays(self, command):
+        delay = self.initial
+        while True:
+            yield delay
+            delay = min(delay * self.factor, self.maximum)
+
+    def record(self, command, latency):
+        pass
+
+
+class LearnedPolling(ExponentialPolling):
+    # Sleep for most of the typical completion time of the command before backing off
+    # The first sleep is capped, a command which usually takes long may still complete early
+    def __init__(self, weight = 0.2, margin = 0.8, first_limit = 1, **kwargs):
+        super().__init__(**kwargs)
+        self.weight = weight
+        self.margin = margin
+        self.first_limit = first_limit
+        self.typical = {}
+
+    def delays(self, command):
+        if command in self.typical:
+            yield min(self.typical[command] * self.margin, self.first_limit)
+        yield from super().delays(command)
+
+    def record(self, command, latency):
+        # Exponentially weighted moving average of the completion time
+        typical = self.typical.get(command, latency)
+        self.typical[command] = typical + self.weight * (latency - typical)
+
+
+def polling_key(command, data):
+    # Completion times are learned per command, FLem per erased sector count as its time grows with it
+    if command == "FLem" and len(data) > 4:
+        return f"FLem/{data[4]}"
+    return command
+
+
+polling_strategies = {
+    "busy": BusyPolling,
+    "exponential": ExponentialPolling,
+    "learned": LearnedPolling,
+}
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of sorted values
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class CommandStats:
+    # Completion latency and CMD1 poll count of every 4CC command
+    def __init__(self):
+        self.latencies = {}
+        self.polls = {}
+        self.failures = {}
+
+    def record(self, command, latency, polls):
+        self.latencies.setdefault(command, []).append(latency)
+        self.polls[command] = self.polls.get(command, 0) + polls
+
+    def record_failure(self, command, polls):
+        # Rejected or timed out command
+        self.failures[command] = self.failures.get(command, 0) + 1
+        self.polls[command] = self.polls.get(command, 0) + polls
+
+    def summary(self):
+        # (command, count, min, p50, p99, max, polls, failures), latencies in milliseconds
+        rows = []
+        for command, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            rows.append((command, len(latencies), latencies[0] * 1000, percentile(latencies, 0.5) * 1000,
+                         percentile(latencies, 0.99) * 1000, latencies[-1] * 1000, self.polls[command], self.failures.get(command, 0)))
+        for command, failures in self.failures.items():
+            if command not in self.latencies:
+                rows.append((command, 0, 0, 0, 0, 0, self.polls[command], failures))
+        return rows
+
+    def print_summary(self):
+        print("4CC   count    min[ms]    p50[ms]    p99[ms]    max[ms]   polls  failed")
+        for command, count, minimum, p50, p99, maximum, polls, failures in self.summary():
+            print(f"{command}  {count:6d} {minimum:10.2f} {p50:10.2f} {p99:10.2f} {maximum:10.2f} {polls:7d} {failures:7d}")
@@ -0,0 +1,179 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Keep PD Controller sessions open between invocations and serve requests over a Unix domain socket
+# Protocol: the client sends one JSON line {"args": {...}}, the daemon answers with {"output": text} lines
+# and a final {"success": bool} line
+
+import os
+import sys
+import json
+import queue
+import socket
+import threading
+import socketserver
+
+
+class RequestOutput:
+    # Route what a session worker prints to the client of the request being served
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            return self.stream.write(text)
+        try:
+            client.write((json.dumps({"output": text}) + "\n").encode())
+        except OSError:
+            # The client went away, the request still runs to completion
+            pass
+        return len(text)
+
+    def flush(self):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            return self.stream.flush()
+        try:
+            client.flush()
+        except OSError:
+            pass
+
+
+class Request:
+    def __init__(self, args, client):
+        self.args = args
+        self.client = client
+        self.success = False
+        self.done = threading.Event()
+
+
+class Session:
+    # One board, its requests run one at a time in the order they arrived
+    def __init__(self, key, connect, handle, output):
+        self.key = key
+        self.connect = connect
+        self.handle = handle
+        self.output = output
+        self.device = None
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target = self.serve, name = f"session-{key}", daemon = True)
+        self.thread.start()
+
+    def submit(self, request):
+        self.requests.put(request)
+        request.done.wait()
+        return request.success
+
+    def serve(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            self.output.local.client = request.client
+            try:
+                if self.device is None:
+                    print(f"Connecting to {self.key}")
+                    self.device = self.connect(self.key)
+                request.success = self.handle(self.device, request.args)
+            except (Exception, SystemExit) as e:
+                # TPS65988 exits when it cannot claim the bus, the next request connects again
+                print(f"Failed: {(str(e) or type(e).__name__) if isinstance(e, Exception) else 'Connection failed'}")
+                self.disconnect()
+            finally:
+                self.output.local.client = None
+                request.done.set()
+        self.disconnect()
+
+    def disconnect(self):
+        if self.device is not None:
+            try:
+                self.device.bus.close()
+            except Exception:
+                pass
+            self.device = None
+
+    def stop(self):
+        self.requests.put(None)
+        self.thread.join()
+
+
+class Daemon(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, connect, handle, device_key, mode = 0o600):
+        # connect(key) opens a board, handle(device, args) serves a request, device_key(args) names the board
+        # mode are the socket permissions, requests can flash boards and write files as the daemon user
+        self.connect = connect
+        self.handle = handle
+        self.device_key = device_key
+        self.mode = mode
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.output = RequestOutput(sys.stdout)
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, RequestHandler)
+
+    def server_bind(self):
+        # The umask keeps the socket from being reachable with the default permissions between bind and chmod
+        umask = os.umask(0o777 & ~self.mode)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, self.mode)
+
+    def session(self, key):
+        with self.lock:
+            if key not in self.sessions:
+                self.sessions[key] = Session(key, self.connect, self.handle, self.output)
+            return self.sessions[key]
+
+    def serve(self):
+        sys.stdout = self.output
+        try:
+            self.serve_forever()
+        finally:
+            sys.stdout = self.output.stream
+            for session in self.sessions.values():
+                session.stop()
+            self.server_close()
+            os.remove(self.server_address)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        args = json.loads(self.rfile.readline())["args"]
+        request = Request(args, self.wfile)
+        success = self.server.session(self.server.device_key(args)).submit(request)
+        self.wfile.write((json.dumps({"success": success}) + "\n").encode())
+
+
+def send_request(path, args, stream = None):
+    # Run a request on the daemon listening on path, prints its output as it arrives and returns its result
+    stream = stream or sys.stdout
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        client.sendall((json.dumps({"args": args}) + "\n").encode())
+        with client.makefile("rb") as response:
+            for line in response:
+                message = json.loads(line)
+                if "output" in message:
+                    stream.write(message["output"])
+                    stream.flush()
+                else:
+                    return message["success"]
+    return False
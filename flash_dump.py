@@ -0,0 +1,205 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+ERASED_BYTE = 0xFF
+PAGE_SIZE = 4096
+
+
+def open_for_resume(path, mode, resume_offset):
+    # Open for writing from scratch or, when resuming, keep the existing file content
+    if resume_offset and os.path.exists(path):
+        return open(path, "r+" + mode)
+    return open(path, "w" + mode)
+
+
+class RawWriter:
+    # Plain binary image, skipped space is filled with erased bytes
+    suffix = ""
+
+    @staticmethod
+    def available(path):
+        # Flash bytes already present in an existing dump
+        return os.path.getsize(path)
+
+    @staticmethod
+    def block(path, addr):
+        # 16 byte flash block of an existing dump
+        with open(path, "rb") as file:
+            file.seek(addr)
+            return file.read(16)
+
+    def __init__(self, path, resume_offset = 0):
+        self.file = open_for_resume(path, "b", resume_offset)
+        self.file.truncate(resume_offset)
+        self.file.seek(resume_offset)
+        self.position = resume_offset
+
+    def write(self, addr, block):
+        if addr > self.position:
+            self.file.write(bytes([ERASED_BYTE]) * (addr - self.position))
+        self.file.write(block)
+        self.position = addr + len(block)
+
+    def close(self):
+        self.file.close()
+
+
+class SparseWriter(RawWriter):
+    # Binary image with skipped space left as file system holes, which read back as 0x00 and not as erased 0xFF
+    # Only the blocks which were read hold flash content, the file is extended to whole 4KB pages
+    suffix = ".sparse"
+
+    def write(self, addr, block):
+        self.file.seek(addr)
+        self.file.write(block)
+        self.position = addr + len(block)
+
+    def close(self):
+        self.file.truncate(self.position + -self.position % PAGE_SIZE)
+        self.file.close()
+
+
+class HexTextWriter:
+    # One line of 16 hex bytes per flash block, skipped blocks are printed as erased
+    suffix = ".txt"
+    line_length = len(" ".join(["00"] * 16)) + 1
+
+    @classmethod
+    def available(cls, path):
+        return os.path.getsize(path) // cls.line_length * 16
+
+    @classmethod
+    def block(cls, path, addr):
+        with open(path) as file:
+            file.seek(addr // 16 * cls.line_length)
+            return bytes.fromhex(file.read(cls.line_length))
+
+    def __init__(self, path, resume_offset = 0):
+        self.file = open_for_resume(path, "", resume_offset)
+        self.file.truncate(resume_offset // 16 * self.line_length)
+        self.file.seek(resume_offset // 16 * self.line_length)
+        self.position = resume_offset
+
+    def write(self, addr, block):
+        while addr > self.position:
+            self.file.write(" ".join(["{:02x}".format(ERASED_BYTE)] * 16) + "\n")
+            self.position += 16
+        self.file.write(" ".join(["{:02x}".format(byte) for byte in block]) + "\n")
+        self.position = addr + len(block)
+
+    def close(self):
+        self.file.close()
+
+
+class IntelHexWriter:
+    # Intel HEX records of the blocks actually read
+    suffix = ".hex"
+
+    @staticmethod
+    def records(path):
+        # (address, length, line) of the data and extended address records in an existing file
+        upper = 0
+        with open(path) as file:
+            for line in file:
+                # Skip records cut short by an interrupted dump
+                if not line.startswith(":") or not line.endswith("\n") or len(line) < 12 or len(line) != 12 + 2 * int(line[1:3], 16):
+                    continue
+                record_type = int(line[7:9], 16)
+                if record_type == 0x04:
+                    upper = int(line[9:13], 16) << 16
+                    yield upper, 0, line
+                elif record_type == 0x00:
+                    yield upper + int(line[3:7], 16), int(line[1:3], 16), line
+
+    @classmethod
+    def available(cls, path):
+        return max([addr + length for addr, length, line in cls.records(path)], default = 0)
+
+    @classmethod
+    def block(cls, path, addr):
+        for record_addr, length, line in cls.records(path):
+            if record_addr == addr and length:
+                return bytes.fromhex(line[9 : 9 + 2 * length])
+        return b""
+
+    def __init__(self, path, resume_offset = 0):
+        lines = []
+        self.upper = None
+        if resume_offset and os.path.exists(path):
+            # Keep the records below the resume offset, drop everything from the EOF record on
+            for addr, length, line in self.records(path):
+                if addr + length <= resume_offset:
+                    lines.append(line)
+                    self.upper = addr >> 16
+        self.file = open(path, "w")
+        self.file.writelines(lines)
+
+    def record(self, addr, record_type, data):
+        record = [len(data), (addr >> 8) & 0xFF, addr & 0xFF, record_type] + list(data)
+        checksum = -sum(record) & 0xFF
+        self.file.write(":" + "".join(["{:02X}".format(byte) for byte in record + [checksum]]) + "\n")
+
+    def write(self, addr, block):
+        if addr >> 16 != self.upper:
+            self.upper = addr >> 16
+            self.record(0, 0x04, [self.upper >> 8, self.upper & 0xFF])
+        self.record(addr & 0xFFFF, 0x00, block)
+
+    def close(self):
+        self.record(0, 0x01, [])
+        self.file.close()
+
+
+dump_formats = {
+    "raw": RawWriter,
+    "sparse": SparseWriter,
+    "hex": HexTextWriter,
+    "ihex": IntelHexWriter,
+}
+
+
+def read_block(path, formats, addr):
+    # 16 byte block at addr of an existing dump, taken from the first selected output holding it, None when none does
+    for name in formats:
+        output = path + dump_formats[name].suffix
+        if os.path.exists(output) and dump_formats[name].available(output) >= addr + 16:
+            return dump_formats[name].block(output, addr)
+    return None
+
+
+class DumpWriter:
+    # Stream every flash block into all selected output formats as soon as it is read
+    def __init__(self, path, formats, resume_offset = 0):
+        # Resume no further than the shortest existing output reaches
+        for name in formats:
+            output = path + dump_formats[name].suffix
+            available = dump_formats[name].available(output) if os.path.exists(output) else 0
+            resume_offset = min(resume_offset, available)
+        self.resume_offset = resume_offset - resume_offset % 16
+        self.writers = [dump_formats[name](path + dump_formats[name].suffix, self.resume_offset) for name in formats]
+
+    def write(self, addr, block):
+        for writer in self.writers:
+            writer.write(addr, block)
+
+    def flush(self):
+        # Push the blocks written so far to disk, so a resumed dump finds them
+        for writer in self.writers:
+            writer.file.flush()
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
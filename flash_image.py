@@ -0,0 +1,70 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import mmap
+
+ERASED_BYTE = 0xFF
+FLASH_WRITE_SIZE = 64
+FLASH_SECTOR_SIZE = 4 * 1024
+ERASED_SECTOR = bytes([ERASED_BYTE]) * FLASH_SECTOR_SIZE
+
+
+class FlashImage:
+    # Configuration image mapped read-only, the pages are shared with every other user of the file
+    # Content past the end of the file reads as erased flash, padding the image to whole 64 byte chunks
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.length = os.fstat(self.file.fileno()).st_size
+        # An empty file cannot be mapped
+        self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ) if self.length else b""
+        self.view = memoryview(self.map)
+        self.size = self.length + (-self.length % FLASH_WRITE_SIZE)
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read(self, addr, length, end = None):
+        # Content of [addr, addr + length), bytes at and past end (the file end by default) read as erased
+        # A view into the mapping without copying when the range lies before end, a padded copy otherwise
+        end = self.length if end is None else min(end, self.length)
+        if addr + length <= end:
+            return self.view[addr : addr + length]
+        data = bytes(self.view[min(addr, end) : end])
+        return data + bytes([ERASED_BYTE]) * (length - len(data))
+
+    def erased(self, addr, length):
+        # True when [addr, addr + length) holds only erased bytes, compared a sector at a time
+        for start in range(addr, min(addr + length, self.length), FLASH_SECTOR_SIZE):
+            end = min(start + FLASH_SECTOR_SIZE, addr + length, self.length)
+            if self.view[start : end] != ERASED_SECTOR[: end - start]:
+                return False
+        return True
+
+    def close(self):
+        # Views returned by read() may outlive the image, the mapping is then unmapped once the last of them is gone
+        self.view.release()
+        if self.length:
+            try:
+                self.map.close()
+            except BufferError:
+                pass
+        self.file.close()
@@ -0,0 +1,152 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import zlib
+import struct
+from collections import namedtuple
+
+# Each region pointer sits at the start of a 4KB sector, the header offset in the last word of that sector
+RegionPointer = namedtuple('RegionPointer', ['pointer_address', 'offset_address'])
+# Offsets within a region are relative to its header, data is the patch bundle and config the application configuration
+RegionHeader = namedtuple('RegionHeader', ['address', 'magic', 'data_offset', 'data_size', 'data_crc', 'config_offset', 'config_size'])
+# Result of the checks the boot loader reports in Boot Flags for a region
+RegionCheck = namedtuple('RegionCheck', ['region', 'header', 'header_invalid', 'read_invalid', 'crc_fail'])
+
+region_pointers = (RegionPointer(0x0000, 0x0FFC), RegionPointer(0x1000, 0x1FFC))
+
+FLASH_SECTOR_SIZE = 4 * 1024
+REGION_HEADER_MAGIC = 0xACE00001
+REGION_HEADER_SIZE = 0x80
+CONFIG_SECTION_WORDS = 0x44  # configuration size and offset words within the header
+ERASED_WORD = 0xFFFFFFFF
+
+
+def read_word(read, addr):
+    return struct.unpack("<I", bytes(read(addr, 4)))[0]
+
+
+def region_header_address(read, region):
+    # Header address of the region, None when the pointer is erased
+    pointer = read_word(read, region_pointers[region].pointer_address)
+    offset = read_word(read, region_pointers[region].offset_address)
+    if pointer == ERASED_WORD or offset == ERASED_WORD:
+        return None
+    return pointer + offset
+
+
+def read_region_header(read, region):
+    # Parsed region header, None when the region is not populated
+    addr = region_header_address(read, region)
+    if addr is None:
+        return None
+    magic, _, data_offset, data_size, data_crc = struct.unpack("<5I", bytes(read(addr, 20)))
+    if magic != REGION_HEADER_MAGIC:
+        return None
+    config_size, config_offset = struct.unpack("<2I", bytes(read(addr + CONFIG_SECTION_WORDS, 8)))
+    if config_size == ERASED_WORD or config_offset == ERASED_WORD:
+        config_size, config_offset = 0, 0
+    return RegionHeader(addr, magic, data_offset, data_size, data_crc, config_offset, config_size)
+
+
+def region_sections(header):
+    # (name, start, end) of the header, configuration and patch data of a region
+    sections = [("header", header.address, header.address + REGION_HEADER_SIZE)]
+    if header.config_size:
+        sections.append(("config", header.address + header.config_offset, header.address + header.config_offset + header.config_size))
+    sections.append(("patch", header.address + header.data_offset, header.address + header.data_offset + header.data_size))
+    return sections
+
+
+def region_crc(data):
+    # Patch data CRC as stored in the header: CRC-32 without the final inversion, bit reversed
+    crc = zlib.crc32(data) ^ 0xFFFFFFFF
+    return int(f"{crc:032b}"[::-1], 2)
+
+
+def check_region(read, region, size):
+    # Check a region the way the boot loader does, sections have to fit below size
+    header = read_region_header(read, region)
+    if header is None:
+        return RegionCheck(region, None, True, False, False)
+    read_invalid = any(end > size for name, start, end in region_sections(header))
+    crc_fail = not read_invalid and region_crc(read(header.address + header.data_offset, header.data_size)) != header.data_crc
+    return RegionCheck(region, header, False, read_invalid, crc_fail)
+
+
+def check_image(read, size):
+    # (region checks, problems which would keep the configuration from loading)
+    # A region without a header is skipped by the boot loader, a broken one fails the boot
+    checks = [check_region(read, region, size) for region in range(len(region_pointers))]
+    problems = []
+    for check in checks:
+        if check.read_invalid:
+            problems.append(f"Region {check.region} reaches past the end of the image at {hex(size)}")
+        if check.crc_fail:
+            problems.append(f"Region {check.region} patch data CRC does not match its header ({check.header.data_crc:#010x})")
+    if all(check.header_invalid for check in checks):
+        problems.append("No region holds a valid header")
+    return checks, problems
+
+
+def populated_ranges(read):
+    # (start, end) address ranges holding the region pointers and populated regions
+    # read(addr, length) returns flash content, either from an image or from the device
+    ranges = []
+    for pointer in region_pointers:
+        ranges.append((pointer.pointer_address, pointer.pointer_address + 4))
+        ranges.append((pointer.offset_address, pointer.offset_address + 4))
+    for region in range(len(region_pointers)):
+        header = read_region_header(read, region)
+        if header is not None:
+            ranges += [(start, end) for name, start, end in region_sections(header)]
+    return merge_ranges(ranges)
+
+
+def merge_ranges(ranges, align = 1):
+    # Sort (start, end) ranges, expand them to the alignment and merge the overlapping ones
+    merged = []
+    for start, end in sorted(ranges):
+        start -= start % align
+        end += -end % align
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_ranges(ranges, removed):
+    # Parts of (start, end) ranges not covered by the sorted, merged removed ranges
+    kept = []
+    for start, end in ranges:
+        for removed_start, removed_end in removed:
+            if removed_end <= start or removed_start >= end:
+                continue
+            if removed_start > start:
+                kept.append((start, removed_start))
+            start = removed_end
+        if start < end:
+            kept.append((start, end))
+    return kept
+
+
+def sector_crcs(read, ranges):
+    # CRC32 of the parts of every 4KB sector covered by (start, end) ranges, keyed by the sector address
+    crcs = {}
+    for start, end in ranges:
+        for sector in range(start - start % FLASH_SECTOR_SIZE, end, FLASH_SECTOR_SIZE):
+            part_start = max(start, sector)
+            part_end = min(end, sector + FLASH_SECTOR_SIZE)
+            crcs[sector] = zlib.crc32(read(part_start, part_end - part_start), crcs.get(sector, 0))
+    return crcs
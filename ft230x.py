@@ -1,14 +1,98 @@
+import os
+import json
 import time
+import fcntl
+import tempfile
+import hashlib
 from pyftdi.ftdi import Ftdi
 from pyftdi.eeprom import FtdiEeprom
 
+# Transaction engine step types
+OP_SET = 0          # apply pin state
+OP_SAMPLE = 1       # apply pin state and sample SDA as a data bit
+OP_ACK = 2          # apply pin state and sample SDA, abort the transaction on NACK
+OP_WAIT_IDLE = 3    # apply pin state and wait for SDA to be released
+OP_SCL_HIGH = 4     # apply pin state and wait while the target stretches the clock
+
+# Every step reading the pins also waits for a released SCL to go high, plain SCL releases are not checked
+BUS_TIMEOUT = 0.05  # seconds a target may hold SDA or SCL low
+GET_GPIO_USB_OPS = 2  # get_cbus_gpio switches to CBUS bitbang mode before reading the pins
+
+# Delays added after every pin update, tried from the fastest one until the target answers reliably
+CALIBRATION_DELAYS = (0, 0.00001, 0.00002, 0.00005, 0.0001, 0.0002, 0.0005, 0.001)
+CALIBRATION_READS = 20
+TOGGLE_RATE_SAMPLES = 200
+
+# EEPROM properties needed to bit bang I2C on the CBUS pins, and the ones restored for UART use on close
+gpio_eeprom_config = {
+    "cbus_slow_slew": False,
+    "cbus_func_0": "GPIO",  # SDA
+    "cbus_func_1": "GPIO",  # Enable signal
+    "cbus_func_3": "GPIO",  # SCL
+}
+uart_eeprom_config = {
+    "cbus_func_1": "RXLED",
+    "cbus_func_2": "TXLED",
+}
+# Fingerprints of the GPIO related EEPROM properties and calibration results, per FTDI serial number
+EEPROM_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "tps65988_flash", "ft230x_eeprom.json")
+CALIBRATION_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "tps65988_flash", "ft230x_calibration.json")
+
 
 def lsbblock2hex(block):
     return " ".join(["{:02x}".format(byte) for byte in block[::-1]])
 
 
+def eeprom_fingerprint(config):
+    return hashlib.sha256(json.dumps(config, sort_keys = True).encode()).hexdigest()
+
+
+def load_cache(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def update_cache(path, serial, value):
+    # Per adapter caches are only an optimization, failing to store them is not an error
+    # Adapters of a --targets run update the file concurrently: the read-modify-write holds a lock and the new content
+    # replaces the file at once, readers never see it half written
+    if serial is None or path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            cache = load_cache(path)
+            cache[serial] = value
+            fd, temporary = tempfile.mkstemp(dir = os.path.dirname(path), prefix = os.path.basename(path) + ".")
+            try:
+                with os.fdopen(fd, "w") as file:
+                    json.dump(cache, file, indent = 1)
+                os.replace(temporary, path)
+            except OSError:
+                os.remove(temporary)
+                raise
+    except OSError:
+        pass
+
+
+def open_transport(device, bus = None, debug = False, keep_gpio = False, **options):
+    # Factory of the ft230x transport, see transports.py; device is the FTDI URL
+    if bus is not None:
+        return bus
+    return cbusBitBang(ftdi_addr = device, i2c_debug = debug, keep_gpio = keep_gpio)
+
+
 class cbusBitBang:
-    def __init__(self, ftdi_addr = "ftdi://ftdi/1",pin_number_sda=0x0, pin_number_scl=0x3,pin_number_switch=0x1, i2c_debug = False):
+    # Transport interface, see transports.py
+    name = "ft230x"
+    combines_transfers = False  # bit banged transactions gain nothing from being combined
+    max_reads = 21  # register reads per read_registers batch, issued one at a time
+
+    def __init__(self, ftdi_addr = "ftdi://ftdi/1",pin_number_sda=0x0, pin_number_scl=0x3,pin_number_switch=0x1, i2c_debug = False, ftdi = None, keep_gpio = False, eeprom_cache = EEPROM_CACHE, clock_stretching = True, calibration_cache = CALIBRATION_CACHE):
        
         self.cbus_mask = 0xF & (0x1 << pin_number_sda | 0x1 << pin_number_scl | 0x1 << pin_number_switch)
 
@@ -20,6 +104,30 @@ class cbusBitBang:
         # Set curr cbus configuration to all HIGH_Z
         self.curr_cbus_register = 0b0000   
 
+        # Seconds added after each pin update, set by calibrate()
+        self.half_period = 0
+        self.clock_stretching = clock_stretching
+        self.timeout = BUS_TIMEOUT
+        self.calibration_cache = calibration_cache
+
+        # Compiled read transactions and USB operation counters
+        self.transactions = {}
+        self.usb_ops = 0
+        self.last_usb_ops = 0
+
+        # keep_gpio leaves the CBUS pins as GPIO on close, for a batch of sessions on the same adapter
+        self.keep_gpio = keep_gpio
+        self.eeprom_cache = eeprom_cache
+        self.eeprom = None
+        self.serial = None
+        self.manage_eeprom = ftdi is None
+
+        if ftdi is not None:
+            # Use an already opened (or simulated) device with the CBUS pins configured as GPIO
+            self.ftdi = ftdi
+            self.drive_switch_low()
+            return
+
         # Create and open an instance of FTDI
         self.ftdi = Ftdi()
 
@@ -34,25 +142,77 @@ class cbusBitBang:
         # Validate CBUS feature with the current device
         assert self.ftdi.has_cbus, "This FTDI device has no CBUS"
 
-        # Validate CBUS EEPROM configuration with the current device
-        self.eeprom = FtdiEeprom()
-        self.eeprom.connect(self.ftdi)
-        self.eeprom.set_property("cbus_slow_slew", "FAST") #SDA
-
-        # If curent eeprom does not have cbus pins conf as GPIO, modyfiy it
-        if not self.eeprom.cbus_mask & self.cbus_mask == self.cbus_mask:
-
-            self.eeprom.set_property("cbus_slow_slew", "FAST") #SDA
-            self.eeprom.set_property("cbus_func_0", "GPIO") #SDA
-            self.eeprom.set_property("cbus_func_1", "GPIO") #Enable signal
-            self.eeprom.set_property("cbus_func_3", "GPIO") #SCL
-            print("Reconfiguring the CBUS pins as GPIO")
-            self.eeprom.commit(dry_run=False)            
-            self.eeprom.reset_device()
+        try:
+            self.serial = self.ftdi.usb_dev.serial_number
+        except Exception:
+            self.serial = None
+
+        # The EEPROM read is skipped when it held the GPIO configuration the last time this adapter was used
+        if self.serial is not None and self.cached_fingerprint() == eeprom_fingerprint(gpio_eeprom_config):
+            print("CBUS pins configured as GPIO according to the EEPROM cache")
+        else:
+            # Validate CBUS EEPROM configuration with the current device
+            self.eeprom = FtdiEeprom()
+            self.eeprom.connect(self.ftdi)
+            self.update_eeprom(gpio_eeprom_config, "Reconfiguring the CBUS pins as GPIO")
             #self.eeprom.dump_config()
+            self.store_fingerprint()
 
         self.drive_switch_low()
            
+    def update_eeprom(self, config, message):
+        # Program only the properties which differ, returns True when the EEPROM was written
+        changes = {name: value for name, value in config.items() if getattr(self.eeprom, name, None) != value}
+        if not changes:
+            return False
+        for name, value in changes.items():
+            self.eeprom.set_property(name, value)
+        print(message)
+        self.eeprom.commit(dry_run=False)
+        self.eeprom.reset_device()
+        return True
+
+    def cached_fingerprint(self):
+        return load_cache(self.eeprom_cache).get(self.serial) if self.eeprom_cache else None
+
+    def store_fingerprint(self):
+        # Remember the GPIO related EEPROM properties of this adapter
+        update_cache(self.eeprom_cache, self.serial, eeprom_fingerprint({name: getattr(self.eeprom, name, None) for name in gpio_eeprom_config}))
+
+    def measure_toggle_rate(self):
+        # Pin updates per second the adapter manages over USB
+        start = time.perf_counter()
+        for sample in range(TOGGLE_RATE_SAMPLES):
+            self.ftdi.set_cbus_gpio(0b0000)
+        self.usb_ops += TOGGLE_RATE_SAMPLES
+        return TOGGLE_RATE_SAMPLES / (time.perf_counter() - start)
+
+    def calibrate(self, probe, force = False):
+        # Find the shortest pin update delay at which probe() returns the same as at the slowest rate
+        # probe() runs a test transaction and returns its result, -1 when it was not acknowledged
+        cached = load_cache(self.calibration_cache).get(self.serial) if self.calibration_cache else None
+        if cached is not None and not force:
+            self.half_period = cached["half_period"]
+            return cached
+        toggle_rate = self.measure_toggle_rate()
+        self.half_period = CALIBRATION_DELAYS[-1]
+        reference = probe()
+        if reference == -1:
+            print("FT230X calibration failed, the target does not respond")
+            self.half_period = 0
+            return None
+        for idx, delay in enumerate(CALIBRATION_DELAYS):
+            self.half_period = delay
+            if all(probe() == reference for read in range(CALIBRATION_READS)):
+                break
+        # Safety margin: one step slower than the fastest reliable delay, unless USB latency alone was enough
+        if self.half_period:
+            self.half_period = CALIBRATION_DELAYS[min(idx + 1, len(CALIBRATION_DELAYS) - 1)]
+        result = {"half_period": self.half_period, "toggle_rate": toggle_rate}
+        update_cache(self.calibration_cache, self.serial, result)
+        print(f"FT230X calibrated: {toggle_rate:.0f} pin updates/s, {self.half_period * 1e6:.0f}us delay per update")
+        return result
+
     def __exit__(self):
         self.close()
         
@@ -61,6 +221,7 @@ class cbusBitBang:
         self.curr_cbus_register = self.curr_cbus_register & (~pin_mask)
         #Send new mask to the ftdi
         self.ftdi.set_cbus_direction(self.cbus_mask, self.curr_cbus_register)
+        self.usb_ops += GET_GPIO_USB_OPS
 
         return self.ftdi.get_cbus_gpio() & pin_mask   
 
@@ -73,7 +234,8 @@ class cbusBitBang:
         self.ftdi.set_cbus_direction(self.cbus_mask, self.curr_cbus_register)
         
         #Drive the pin low
-        self.ftdi.set_cbus_gpio(0b0000)    
+        self.ftdi.set_cbus_gpio(0b0000)
+        self.usb_ops += 1    
     
     def read_SDA(self):
         # Set SDA as input and read the bus value
@@ -100,140 +262,198 @@ class cbusBitBang:
         # Set switch pin as output and drive the pin low    
         self.drive_cbus_pin_low(self.cbus_switch_mask)
 
-    def write_i2c_bit(self, bit):
-        if bit:
-            self.read_SDA()
-
-        else:
-            self.drive_SDA_low()
-
-        self.read_SCL()
-        self.drive_SCL_low()
-        self.read_SDA()
-
-    def read_i2c_bit(self):
-        self.read_SCL()
-        bit = self.read_SDA()
-        self.drive_SCL_low()
-
-        return bit
-
     def stop_condition(self):
         # Master first releases the SCL and then the SDA line.
         self.drive_SDA_low()
         self.read_SCL()
         self.read_SDA()       
 
-    def start_condition(self):
-        # Sda goes low while scl is high
-        while self.read_SDA() != 1:
-            self.i2c_delay()
-        self.read_SCL()
-        self.drive_SDA_low()        
+    def recover_bus(self):
+        # Clock out a target stuck driving SDA low (at most 9 clocks), then release the bus with a stop condition
         self.drive_SCL_low()
+        for clock in range(9):
+            if self.read_SDA():
+                break
+            self.read_SCL()
+            self.drive_SCL_low()
+        self.stop_condition()
+        return self.read_SDA() != 0
 
     def i2c_delay(self):
-        # Delay in between the frames for better synchronization        
-        #time.sleep(0.002)
-        pass
-
-    def write_to_i2c(self, addres, data):
-        driver.start_condition()
-        for i in range(6, -1, -1):
-            # Shift the bit to the rightmost position and mask with 1 to get its value
-            self.write_i2c_bit((addres >> i) & 1)
-
-        driver.write_i2c_bit(0)  # write
-
-        if self.read_i2c_bit() != 0:
-            print("[NACK] No response after sending device address")
-            driver.stop_condition()
-            return -1
-
-        for i in range(7, -1, -1):
-            # Shift the bit to the rightmost position and mask with 1 to get its value
-            self.write_i2c_bit((data >> i) & 1)
-
-        if self.read_i2c_bit() != 0:
-            print("[NACK] No response after sending data")
-            driver.stop_condition()
-
-            return -1
-
-        driver.stop_condition()
+        # Delay in between the frames for better synchronization, calibrated per adapter
+        if self.half_period:
+            time.sleep(self.half_period)
+
+    def _pin_state(self, sda_low, scl_low):
+        # CBUS direction register value for the given SDA/SCL levels
+        state = self.curr_cbus_register & ~(self.cbus_sda_mask | self.cbus_scl_mask)
+        if sda_low:
+            state |= self.cbus_sda_mask
+        if scl_low:
+            state |= self.cbus_scl_mask
+        return state
+
+    def compile_transaction(self, frames):
+        # Translate I2C frames into a precomputed sequence of (op, pin state, label) steps
+        # Frames: ("start",), ("stop",), ("scl_low",), ("write", byte, nack_label), ("read", last_byte)
+        steps = []
+        sda_low = bool(self.curr_cbus_register & self.cbus_sda_mask)
+        scl_low = bool(self.curr_cbus_register & self.cbus_scl_mask)
+
+        def step(op, label = None):
+            steps.append((op, self._pin_state(sda_low, scl_low), label))
+
+        def clock(op = OP_SET, label = None):
+            nonlocal scl_low
+            scl_low = False
+            step(op, label)
+            scl_low = True
+            step(OP_SET)
+
+        for frame in frames:
+            if frame[0] == "start":
+                # SDA goes low while SCL is high
+                sda_low = False
+                step(OP_WAIT_IDLE)
+                scl_low = False
+                step(OP_SET)
+                sda_low = True
+                step(OP_SET)
+                scl_low = True
+                step(OP_SET)
+            elif frame[0] == "stop":
+                # Master first releases the SCL and then the SDA line
+                sda_low = True
+                step(OP_SET)
+                scl_low = False
+                step(OP_SET)
+                sda_low = False
+                step(OP_SET)
+            elif frame[0] == "scl_low":
+                scl_low = True
+                step(OP_SET)
+            elif frame[0] == "write":
+                for i in range(7, -1, -1):
+                    sda_low = not (frame[1] >> i) & 1
+                    step(OP_SET)
+                    # Targets stretch the clock at byte boundaries
+                    clock(OP_SCL_HIGH if i == 7 and self.clock_stretching else OP_SET)
+                    sda_low = False
+                    step(OP_SET)
+                # Check for ACK
+                clock(OP_ACK, frame[2])
+            elif frame[0] == "read":
+                for i in range(8):
+                    clock(OP_SAMPLE)
+                # ACK all bytes but the last one
+                sda_low = not frame[1]
+                step(OP_SET)
+                clock()
+                sda_low = False
+                step(OP_SET)
+        return self.optimize_transaction(steps, self.curr_cbus_register)
+
+    def optimize_transaction(self, steps, state):
+        # Drop pin state writes which do not change the bus
+        optimized = []
+        for idx, (op, new_state, label) in enumerate(steps):
+            if op == OP_SET:
+                if new_state == state:
+                    continue
+                # SDA changes while SCL is held low are superseded by the next step
+                if idx + 1 < len(steps) and state & new_state & steps[idx + 1][1] & self.cbus_scl_mask:
+                    continue
+            optimized.append((op, new_state, label))
+            state = new_state
+        return optimized
+
+    def execute_transaction(self, steps):
+        # Run a compiled transaction, returns sampled bits or -1 on NACK
+        # Raises TimeoutError when a target holds SDA or SCL low for longer than self.timeout
+        self.last_usb_ops = 0
+        bits = []
+        try:
+            for op, state, label in steps:
+                if op != OP_ACK:
+                    self.apply_pin_state(op, state, bits)
+                elif self.apply_pin_state(op, state, bits):
+                    message, verbose_only = label
+                    if self.i2c_debug or not verbose_only:
+                        print(message)
+                    # Finish the clock pulse and release the bus with a stop condition
+                    for op, state, label in self.compile_transaction([("scl_low",), ("stop",)]):
+                        self.apply_pin_state(op, state, bits)
+                    bits = -1
+                    break
+        finally:
+            self.usb_ops += self.last_usb_ops
+        if self.i2c_debug:
+            print(f"FTDI transaction: {len(steps)} steps, {self.last_usb_ops} USB operations")
+        return bits
+
+    def apply_pin_state(self, op, state, bits):
+        # set_cbus_gpio is a USB transfer, get_cbus_gpio two (GET_GPIO_USB_OPS), set_cbus_direction none
+        if state != self.curr_cbus_register:
+            self.curr_cbus_register = state
+            self.ftdi.set_cbus_direction(self.cbus_mask, state)
+        if op == OP_SET:
+            self.ftdi.set_cbus_gpio(0b0000)
+            self.last_usb_ops += 1
+            if self.half_period:
+                time.sleep(self.half_period)
+            return 0
+        pins = self.ftdi.get_cbus_gpio()
+        self.last_usb_ops += GET_GPIO_USB_OPS
+        if not state & self.cbus_scl_mask:
+            # SCL is released, the target may keep it low until it is ready
+            deadline = time.monotonic() + self.timeout
+            while not pins & self.cbus_scl_mask:
+                if time.monotonic() > deadline:
+                    raise TimeoutError("SCL held low by the target")
+                pins = self.ftdi.get_cbus_gpio()
+                self.last_usb_ops += GET_GPIO_USB_OPS
+        if self.half_period:
+            time.sleep(self.half_period)
+        value = pins & self.cbus_sda_mask
+        if op == OP_SAMPLE:
+            bits.append(1 if value else 0)
+        elif op == OP_WAIT_IDLE:
+            deadline = time.monotonic() + self.timeout
+            while not value:
+                if time.monotonic() > deadline:
+                    raise TimeoutError("SDA held low by the target")
+                self.i2c_delay()
+                value = self.ftdi.get_cbus_gpio() & self.cbus_sda_mask
+                self.last_usb_ops += GET_GPIO_USB_OPS
+        return value
 
     def read_block_from_i2c(self, addres, register, len):
         if self.i2c_debug:
             print(f"Reading {len} bytes from {addres}@{register}")
-        
-        recieved_data = []
-        self.start_condition()
-
-        # Addr
-        for i in range(6, -1, -1):
-            # Shift the bit to the rightmost position and mask with 1 to get its value
-            # print((addres >> i) & 1)
-            self.write_i2c_bit((addres >> i) & 1)
-
-        # Request Write
-        self.write_i2c_bit(0)
-
-        # Check for ACK
-        if self.read_i2c_bit() != 0:
-            if self.i2c_debug:
-                print(f"[NACK] No response when trying to set up read from {addres}")
-            self.stop_condition()
-            return -1
-
-        # Write Reg addr
-        for i in range(7, -1, -1):
-            # Shift the bit to the rightmost position and mask with 1 to get its value
-            self.write_i2c_bit((register >> i) & 1)
-
-        # Check for ACK
-        if self.read_i2c_bit() != 0:
-            print(f"[NACK] Device rejected reading from register {register}")
-            self.stop_condition()
-            return -1
-
-        self.i2c_delay()
-        # Restart condition
-        self.start_condition()
-
-        # Addr
-        for i in range(6, -1, -1):
-            self.write_i2c_bit((addres >> i) & 1)
-
-        # READ
-        self.write_i2c_bit(1)
 
-        # Check for ACK
-        if self.read_i2c_bit() != 0:
-            print(f"[NACK] No response when trying to read from {addres}")
-            driver.stop_condition()
+        key = (addres, register, len, self.curr_cbus_register)
+        if key not in self.transactions:
+            frames = [
+                ("start",),
+                ("write", addres << 1, (f"[NACK] No response when trying to set up read from {addres}", True)),
+                ("write", register, (f"[NACK] Device rejected reading from register {register}", False)),
+                ("start",),
+                ("write", addres << 1 | 1, (f"[NACK] No response when trying to read from {addres}", False)),
+            ]
+            frames += [("read", requested_byte == len - 1) for requested_byte in range(len)]
+            frames.append(("stop",))
+            self.transactions[key] = self.compile_transaction(frames)
+
+        bits = self.execute_transaction(self.transactions[key])
+        if bits == -1:
             return -1
 
-        self.i2c_delay()
-
-        #Read requested data -1 byte
-        for requested_byte in range(len - 1):
-            self.byte_value = 0
-            for i in range(8):
-                self.byte_value = (self.byte_value << 1) | self.read_i2c_bit()
-            recieved_data.append(self.byte_value)
-
-            self.write_i2c_bit(0)  # ACK
-
-            self.i2c_delay()
-
-        #Read last byte
-        self.byte_value = 0
-        for i in range(8):
-            self.byte_value = (self.byte_value << 1) | self.read_i2c_bit()
-        recieved_data.append(self.byte_value)
-
-        self.write_i2c_bit(1)  # NACK
-        self.stop_condition()
+        recieved_data = []
+        for idx in range(0, len * 8, 8):
+            byte_value = 0
+            for bit in bits[idx : idx + 8]:
+                byte_value = (byte_value << 1) | bit
+            recieved_data.append(byte_value)
 
         if self.i2c_debug:
             print("FTDI Response:", lsbblock2hex(recieved_data))
@@ -246,47 +466,29 @@ class cbusBitBang:
                 f"Writing {data_len} bytes to {addres}@{register}, [{lsbblock2hex(data)}]"
             )
 
-        self.start_condition()
-       
-        # Addr
-        for i in range(6, -1, -1):
-            # Shift the bit to the rightmost position and mask with 1 to get its value
-            self.write_i2c_bit((addres >> i) & 1)
-
-        # Request Write
-        self.write_i2c_bit(0)
-
-        # Check for ACK
-        if self.read_i2c_bit() != 0:
-            print(f"[NACK] No response when trying to write to device: {addres}")
-            self.stop_condition()
-            return -1
-
-        # Reg addr
-        for i in range(7, -1, -1):
-            # Shift the bit to the rightmost position and mask with 1 to get its value
-            self.write_i2c_bit((register >> i) & 1)
+        frames = [
+            ("start",),
+            ("write", addres << 1, (f"[NACK] No response when trying to write to device: {addres}", False)),
+            ("write", register, (f"[NACK] No response after sending register address: {register}", False)),
+        ]
+        frames += [("write", data[byte], (f"[NACK] No response after sending byte number: {byte}", False)) for byte in range(data_len)]
+        frames.append(("stop",))
 
-        # Check for ACK
-        if self.read_i2c_bit() != 0:
-            print(f"[NACK] No response after sending register address: {register}")
-            self.stop_condition()
+        if self.execute_transaction(self.compile_transaction(frames)) == -1:
             return -1
 
-        #Write data
-        for byte in range(data_len):
-            self.i2c_delay()
-            for i in range(7, -1, -1):
-                # Shift the bit to the rightmost position and mask with 1 to get its value
-                self.write_i2c_bit((data[byte] >> i) & 1)
+    def write(self, addr, reg, data):
+        if self.write_block_to_i2c(addr, reg, [len(data) & 0xFF] + list(data)) == -1:
+            raise ValueError("Device unresponsive")
 
-                # Check for ACK
-            if self.read_i2c_bit() != 0:
-                print(f"[NACK] No response after sending byte number: {byte}")
-                self.stop_condition()
-                return -1
+    def read(self, addr, reg, length):
+        output = self.read_block_from_i2c(addr, reg, length)
+        if output == -1:
+            raise ValueError("Device unresponsive")
+        return output
 
-        self.stop_condition()
+    def recover(self):
+        return self.recover_bus()
 
     def close(self):
         self.read_SCL()
@@ -295,13 +497,15 @@ class cbusBitBang:
         # Set curr cbus configuration to all HIGH_Z
         self.curr_cbus_register = 0b0000
         self.ftdi.set_cbus_direction(self.cbus_mask, self.curr_cbus_register)
-        
-        self.eeprom.connect(self.ftdi)            
-        self.eeprom.set_property("cbus_func_1", "RXLED") #Revert to LED indicator    
-        self.eeprom.set_property("cbus_func_2", "TXLED") #Revert to LED indicator              
-        print("Reverting FT230X to UART configuration")
-        self.eeprom.commit(dry_run=False)         
-        self.eeprom.reset_device()
+        if not self.manage_eeprom or self.keep_gpio:
+            return
+
+        if self.eeprom is None:
+            self.eeprom = FtdiEeprom()
+        self.eeprom.connect(self.ftdi)
+        #Revert to LED indicators
+        self.update_eeprom(uart_eeprom_config, "Reverting FT230X to UART configuration")
+        self.store_fingerprint()
         #self.eeprom.dump_config()
         self.eeprom.close()
 
@@ -0,0 +1,85 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import hashlib
+
+JOURNAL_VERSION = 1
+
+
+def file_sha256(path):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+class Journal:
+    # Append-only record of the confirmed steps of a run, reloaded when the same job is run again
+    # The first line describes the job, every following line is one confirmed [phase, address] step
+    def __init__(self, path, job):
+        self.path = path
+        self.job = dict(job, version = JOURNAL_VERSION)
+        self.steps = set()
+        self.file = None
+        if path is None:
+            return
+        if os.path.exists(path):
+            with open(path) as file:
+                lines = file.readlines()
+            # A line cut short by the interruption is dropped, a different job starts a new journal
+            if lines and lines[0].endswith("\n") and json.loads(lines[0]) == self.job:
+                self.steps = {tuple(json.loads(line)) for line in lines[1:] if line.endswith("\n")}
+        if self.steps:
+            self.file = open(path, "a")
+        else:
+            self.file = open(path, "w")
+            self.file.write(json.dumps(self.job) + "\n")
+            self.file.flush()
+
+    def done(self, phase, addr = None):
+        return (phase, addr) in self.steps
+
+    def confirmed(self, phase):
+        # Addresses confirmed in the phase, in ascending order
+        return sorted(addr for step_phase, addr in self.steps if step_phase == phase and addr is not None)
+
+    def confirm(self, phase, addr = None):
+        self.steps.add((phase, addr))
+        if self.file is None:
+            return
+        self.file.write(json.dumps([phase, addr]) + "\n")
+        # The step has to survive a USB disconnect or a killed process
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def reset(self):
+        # Forget the confirmed steps, used when the device no longer matches the journal
+        self.steps = set()
+        if self.file is not None:
+            self.file.seek(0)
+            self.file.truncate()
+            self.file.write(json.dumps(self.job) + "\n")
+            self.file.flush()
+
+    def complete(self):
+        # The job finished, nothing left to resume
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            os.remove(self.path)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
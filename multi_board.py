@@ -0,0 +1,107 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import sys
+import time
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+Target = namedtuple('Target', ['label', 'bus_no', 'ftdi_addr'])
+BoardResult = namedtuple('BoardResult', ['label', 'success', 'duration', 'error'])
+
+
+def parse_target(text):
+    # "ftdi://..." selects an FT230X adapter, anything else is an I2C bus number
+    if text.startswith("ftdi://"):
+        return Target(re.sub(r"[^0-9A-Za-z]+", "_", text[len("ftdi://"):]).strip("_"), None, text)
+    return Target(f"bus{int(text, 0)}", int(text, 0), None)
+
+
+class BoardOutput:
+    # Prefix the lines printed by each board worker with the board label, "\r" progress lines are throttled
+    def __init__(self, stream, progress_interval = 1.0):
+        self.stream = stream
+        self.progress_interval = progress_interval
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def attach(self, label):
+        self.local.label = label
+        self.local.pending = ""
+        self.local.last_progress = 0
+
+    def detach(self):
+        if self.local.pending:
+            self.emit(self.local.pending)
+        self.local.label = None
+
+    def emit(self, line):
+        with self.lock:
+            self.stream.write(f"[{self.local.label}] {line}\n")
+
+    def write(self, text):
+        if getattr(self.local, "label", None) is None:
+            return self.stream.write(text)
+        text = self.local.pending + text
+        for line in re.split(r"(?<=[\r\n])", text)[:-1]:
+            if line.endswith("\r"):
+                now = time.monotonic()
+                if now - self.local.last_progress < self.progress_interval:
+                    continue
+                self.local.last_progress = now
+            if line.strip():
+                self.emit(line.strip())
+        self.local.pending = re.split(r"(?<=[\r\n])", text)[-1]
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def run_boards(targets, worker, jobs = None):
+    # Call worker(target) for all targets concurrently, returns a BoardResult for each of them
+    output = BoardOutput(sys.stdout)
+
+    def run_board(target):
+        output.attach(target.label)
+        start = time.monotonic()
+        success = False
+        error = ""
+        try:
+            success = worker(target)
+        except (Exception, SystemExit) as e:
+            # TPS65988 exits when it cannot claim the bus
+            error = (str(e) or type(e).__name__) if isinstance(e, Exception) else "Connection failed"
+            print(f"Failed: {error}")
+        finally:
+            output.detach()
+        return BoardResult(target.label, success, time.monotonic() - start, error)
+
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers = jobs or len(targets)) as pool:
+            return list(pool.map(run_board, targets))
+    finally:
+        sys.stdout = output.stream
+
+
+def print_report(results):
+    print("Board                          Result   Time[s]")
+    for result in results:
+        status = "PASS" if result.success else "FAIL"
+        print(f"{result.label:30s} {status:6s} {result.duration:9.1f}  {result.error}")
+    passed = len([result for result in results if result.success])
+    print(f"{passed} of {len(results)} boards passed")
@@ -0,0 +1,131 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import csv
+import time
+import struct
+import register_definitions
+
+# Status, power and contract registers sampled on every port, read together in one submission per port
+monitored_registers = (
+    register_definitions.status,
+    register_definitions.power_path_status,
+    register_definitions.active_contract_pdo,
+    register_definitions.active_contract_rdo,
+    register_definitions.power_status,
+    register_definitions.pd_status,
+    register_definitions.data_status,
+)
+# Binary record header: wall clock timestamp, I2C address, register address and content length
+# The register content follows, a zero length marks a port which did not answer
+RECORD_HEADER = struct.Struct("<dBBB")
+FLUSH_INTERVAL = 1.0  # seconds between pushing the recorded changes to disk
+
+
+class CsvSeries:
+    # One row per changed field, the first sample of a register writes all of its fields
+    def __init__(self, path):
+        self.file = open(path, "w", newline = "")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(["timestamp", "port", "register", "field", "value"])
+        self.fields = {}
+
+    def write(self, timestamp, i2c_addr, register, content):
+        key = (i2c_addr, register.address)
+        fields = {} if content is None else register_definitions.decode_content(register, content)
+        previous = self.fields.get(key, {})
+        if content is None:
+            self.writer.writerow([f"{timestamp:.6f}", f"{i2c_addr:#04x}", register.name, "", "unresponsive"])
+        for name, value in fields.items():
+            if name not in previous or previous[name] != value:
+                self.writer.writerow([f"{timestamp:.6f}", f"{i2c_addr:#04x}", register.name, name, value])
+        self.fields[key] = fields
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class BinarySeries:
+    # RECORD_HEADER followed by the raw register content for every change
+    def __init__(self, path):
+        self.file = open(path, "wb")
+
+    def write(self, timestamp, i2c_addr, register, content):
+        content = content or b""
+        self.file.write(RECORD_HEADER.pack(timestamp, i2c_addr, register.address, len(content)) + content)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+series_formats = {
+    "csv": CsvSeries,
+    "binary": BinarySeries,
+}
+
+
+def monitor(PDC, series, duration = 0, interval = 0, registers = monitored_registers):
+    # Sample the registers of both ports back to back (or every interval seconds) for duration seconds, forever with 0
+    # Only changed contents reach the series, so memory use does not grow with the run time
+    # Returns (samples, changes, elapsed seconds)
+    ports = (PDC.i2c_addr1, PDC.i2c_addr2)
+    operations = [("read", register.address, register.size) for register in registers]
+    last = {}
+    samples = 0
+    changes = 0
+    epoch = time.time() - time.perf_counter()
+    start = time.perf_counter()
+    now = start
+    flushed = start
+    previous_addr = PDC.i2c_addr
+    try:
+        while not duration or now - start < duration:
+            for i2c_addr in ports:
+                # Bypass the register cache, every sample goes to the bus
+                # A failed sample is recorded, not retried: recoveries would stall the sampling and hide short glitches
+                PDC.i2c_addr = i2c_addr
+                timestamp = time.perf_counter()
+                try:
+                    outputs = PDC.i2c_transfer(operations, retry = False, quiet = True)
+                except (OSError, ValueError):
+                    outputs = [None] * len(registers)
+                for register, output in zip(registers, outputs):
+                    content = None if output is None else bytes(output[1 : 1 + register.size])
+                    key = (i2c_addr, register.address)
+                    if key not in last or last[key] != content:
+                        last[key] = content
+                        series.write(epoch + timestamp, i2c_addr, register, content)
+                        changes += 1
+            samples += 1
+            now = time.perf_counter()
+            if now - flushed > FLUSH_INTERVAL:
+                series.flush()
+                flushed = now
+            if interval:
+                delay = start + samples * interval - now
+                if delay > 0:
+                    time.sleep(delay)
+                    now = time.perf_counter()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        PDC.i2c_addr = previous_addr
+        series.close()
+    return samples, changes, time.perf_counter() - start
@@ -14,10 +14,119 @@
 
 from collections import namedtuple
 
-Register = namedtuple('Register', ['address', 'size', 'name'])
+# Registers without fields decode to their raw content, immutable ones are read once per firmware session
+Register = namedtuple('Register', ['address', 'size', 'name', 'fields', 'immutable'], defaults = ((), False))
+# bit offset and width within the little endian register content, decode maps the extracted value
+Field = namedtuple('Field', ['name', 'bit', 'width', 'decode'], defaults = (1, None))
 
-global_system_configuration = Register(0x27, 14, "Global System Configuration")
-boot_flags = Register(0x2D, 12, "Boot Flags")
-firmware_version = Register(0x0F, 4, "FW Version")
+
+def text(value, width):
+    # ASCII content, the first character is the lowest byte
+    return value.to_bytes(width // 8, "little").split(b"\0")[0].decode(errors = "replace").strip()
+
+
+def hexadecimal(value, width):
+    return f"{value:0{width // 4}x}"
+
+
+def enum(names):
+    return lambda value, width: names.get(value, value)
+
+
+# A partial map: the registers this tool reads, decoded as far as their fields are listed here
+# GSC and Power Path Status have no fields yet and are kept as raw content
+vendor_id = Register(0x00, 4, "VID", (Field("vendor_id", 0, 32, hexadecimal),), True)
+device_id = Register(0x01, 4, "DID", (Field("device_id", 0, 32, hexadecimal),), True)
+mode = Register(0x03, 4, "MODE", (Field("mode", 0, 32, text),))
+interface_type = Register(0x04, 4, "TYPE", (Field("type", 0, 32, text),), True)
+unique_id = Register(0x05, 16, "UID", (Field("uid", 0, 128, hexadecimal),), True)
 command1 = Register(0x08, 4, "CMD1")
-data1 = Register(0x09, 64, "Data1")
\ No newline at end of file
+data1 = Register(0x09, 64, "Data1")
+firmware_version = Register(0x0F, 4, "FW Version", (Field("version", 0, 32, hexadecimal),), True)
+status = Register(0x1A, 8, "Status", (
+    Field("plug_present", 0),
+    Field("connection_state", 1, 3, enum({0: "no connection", 1: "port disabled", 2: "audio", 3: "debug", 4: "no connection, Ra", 6: "connected", 7: "connected, Ra"})),
+    Field("plug_orientation", 4, 1, enum({0: "upside-up", 1: "upside-down"})),
+    Field("port_role", 5, 1, enum({0: "sink", 1: "source"})),
+    Field("data_role", 6, 1, enum({0: "UFP", 1: "DFP"})),
+    Field("vbus_status", 20, 2, enum({0: "vSafe0V", 1: "vSafe5V", 2: "PD contract", 3: "out of range"})),
+))
+power_path_status = Register(0x26, 5, "Power Path Status")
+global_system_configuration = Register(0x27, 14, "Global System Configuration")
+port_configuration = Register(0x28, 8, "Port Configuration", (
+    Field("typec_state_machine", 0, 2, enum({0: "sink", 1: "source", 2: "DRP", 3: "disabled"})),
+))
+boot_flags = Register(0x2D, 12, "Boot Flags", (
+    Field("spi_flash_present", 3),
+    Field("region0_read_attempt", 4),
+    Field("region1_read_attempt", 5),
+    Field("region0_header_invalid", 6),
+    Field("region1_header_invalid", 7),
+    Field("region0_read_invalid", 8),
+    Field("region1_read_invalid", 9),
+    Field("patch_download_error", 10),
+    Field("region0_crc_fail", 12),
+    Field("region1_crc_fail", 13),
+))
+build_description = Register(0x2E, 49, "Build Description", (Field("description", 0, 49 * 8, text),), True)
+device_info = Register(0x2F, 47, "Device Info", (Field("info", 0, 47 * 8, text),), True)
+active_contract_pdo = Register(0x34, 6, "Active Contract PDO", (Field("pdo", 0, 32, hexadecimal),))
+active_contract_rdo = Register(0x35, 4, "Active Contract RDO", (Field("rdo", 0, 32, hexadecimal),))
+power_status = Register(0x3F, 2, "Power Status", (
+    Field("power_connection", 0),
+    Field("source_sink", 1, 1, enum({0: "source", 1: "sink"})),
+    Field("typec_current", 2, 2, enum({0: "USB default", 1: "1.5A", 2: "3.0A", 3: "PD contract"})),
+))
+pd_status = Register(0x40, 4, "PD Status", (
+    Field("plug_type", 0, 2, enum({0: "USB Type-C full featured", 1: "USB 2.0 Type-C", 2: "reserved", 3: "reserved"})),
+    Field("cc_pull_up", 2, 2, enum({0: "none", 1: "USB default", 2: "1.5A", 3: "3.0A"})),
+    Field("port_type", 4, 2, enum({0: "sink/source", 1: "sink", 2: "source", 3: "source/sink"})),
+    Field("present_role", 6, 1, enum({0: "sink", 1: "source"})),
+))
+data_status = Register(0x5F, 5, "Data Status", (
+    Field("data_connection", 0),
+    Field("connection_orientation", 1),
+    Field("usb2_connection", 4),
+    Field("usb3_connection", 5),
+))
+
+# Registers read by a snapshot, in address order
+registers = (
+    vendor_id, device_id, mode, interface_type, unique_id, firmware_version, status, power_path_status,
+    global_system_configuration, port_configuration, boot_flags, build_description, device_info,
+    active_contract_pdo, active_contract_rdo, power_status, pd_status, data_status,
+)
+by_name = {register.name: register for register in registers}
+
+
+def decode(register, output):
+    # Field values of a register read ([length] + data)
+    return decode_content(register, bytes(output[1 : 1 + register.size]))
+
+
+def decode_content(register, data):
+    # Field values of the register content, the raw content as hex for registers without fields
+    if not register.fields:
+        return {"raw": data[::-1].hex()}
+    value = int.from_bytes(data, "little")
+    fields = {}
+    for field in register.fields:
+        extracted = (value >> field.bit) & ((1 << field.width) - 1)
+        if field.decode is not None:
+            fields[field.name] = field.decode(extracted, field.width)
+        else:
+            fields[field.name] = bool(extracted) if field.width == 1 else extracted
+    return fields
+
+
+def diff_snapshots(first, second, path = ()):
+    # (path, first value, second value) of every field which differs between two decoded snapshots
+    differences = []
+    for key in sorted(set(first) | set(second), key = str):
+        a = first.get(key)
+        b = second.get(key)
+        if isinstance(a, dict) and isinstance(b, dict):
+            differences += diff_snapshots(a, b, path + (key,))
+        elif a != b:
+            differences.append((path + (key,), a, b))
+    return differences
@@ -0,0 +1,288 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import ctypes
+import random
+import struct
+import register_definitions
+import flash_layout
+
+FLASH_SIZE = 1024 * 1024
+FLASH_SECTOR_SIZE = 4 * 1024
+
+# Typical 4CC completion times in seconds
+default_command_latency = {
+    "FLrd": 0.0005,
+    "FLwd": 0.002,
+    "FLad": 0.0005,
+    "FLem": 0.05,
+}
+
+unrecognized_command = list(b"!CMD")
+I2C_M_RD = 0x0001  # read message flag of the Linux I2C_RDWR interface
+
+
+class SimulatedTPS65988:
+    # Register level model of a TPS65988 with an SPI flash attached, as seen from its I2C target ports
+    def __init__(self, image = b"", i2c_addrs = (0x23, 0x27), command_latency = None, transaction_latency = 0, boot_time = 0, error_rate = 0, seed = 0):
+        self.flash = bytearray(b"\xff" * FLASH_SIZE)
+        self.flash[:len(image)] = image
+        self.i2c_addrs = i2c_addrs
+        self.command_latency = dict(default_command_latency if command_latency is None else command_latency)
+        self.transaction_latency = transaction_latency
+        self.boot_time = boot_time
+        # Share of addressing attempts left unacknowledged, as on a flaky link
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.registers = {
+            register_definitions.mode.address: list(b"BOOT"),
+            register_definitions.firmware_version.address: [0x00, 0x10, 0x07, 0x01],
+            register_definitions.global_system_configuration.address: [0] * register_definitions.global_system_configuration.size,
+            register_definitions.command1.address: [0] * register_definitions.command1.size,
+            register_definitions.data1.address: [0] * register_definitions.data1.size,
+        }
+        self.flash_address = 0
+        self.pending = None
+        self.booted_at = 0
+        self.commands = {}
+        self.transactions = 0
+        self.boot()
+
+    def boot(self):
+        # Load the configuration from flash the same way Boot Flags report it
+        flags = 1 << 3  # SPI flash present
+        read = lambda addr, length: self.flash[addr : addr + length]
+        mode = b"PTCH"  # no configuration loaded, waiting for a patch
+        for region in range(len(flash_layout.region_pointers)):
+            flags |= 1 << (4 + region)  # region read attempt
+            check = flash_layout.check_region(read, region, len(self.flash))
+            flags |= check.header_invalid << (6 + region) | check.read_invalid << (8 + region) | check.crc_fail << (12 + region)
+            if not (check.header_invalid or check.read_invalid or check.crc_fail):
+                mode = b"APP "
+                break
+        self.registers[register_definitions.mode.address] = list(mode)
+        self.registers[register_definitions.boot_flags.address] = list(struct.pack("<I", flags)) + [0] * (register_definitions.boot_flags.size - 4)
+        self.booted_at = time.monotonic() + self.boot_time
+
+    def responds(self, i2c_addr):
+        if self.error_rate and self.random.random() < self.error_rate:
+            return False
+        return i2c_addr in self.i2c_addrs and time.monotonic() >= self.booted_at
+
+    def write_register(self, reg, data):
+        self.transactions += 1
+        if self.transaction_latency:
+            time.sleep(self.transaction_latency)
+        self.complete_command()
+        self.registers[reg] = list(data)
+        if reg == register_definitions.command1.address:
+            command = bytes(data).decode(errors = "replace")
+            self.pending = (command, time.monotonic() + self.command_latency.get(command, 0))
+
+    def read_register(self, reg):
+        # Register content prefixed with its length byte
+        self.transactions += 1
+        if self.transaction_latency:
+            time.sleep(self.transaction_latency)
+        self.complete_command()
+        data = self.registers.get(reg, [0] * 64)
+        return [len(data)] + list(data)
+
+    def complete_command(self):
+        # CMD1 keeps the 4CC until the command completes
+        if self.pending is None or time.monotonic() < self.pending[1]:
+            return
+        command = self.pending[0]
+        self.pending = None
+        self.commands[command] = self.commands.get(command, 0) + 1
+        data = bytes(self.registers[register_definitions.data1.address])
+        output = [0]
+        if command == "FLrd":
+            addr = struct.unpack_from("<I", data)[0] % FLASH_SIZE
+            output = list(self.flash[addr : addr + 16])
+        elif command == "FLad":
+            self.flash_address = struct.unpack_from("<I", data)[0] % FLASH_SIZE
+        elif command == "FLwd":
+            # NOR flash can only clear bits, the address auto-increments
+            for offset, byte in enumerate(data[:64]):
+                self.flash[(self.flash_address + offset) % FLASH_SIZE] &= byte
+            self.flash_address = (self.flash_address + 64) % FLASH_SIZE
+        elif command == "FLem":
+            addr, sectors = struct.unpack_from("<IB", data)
+            addr -= addr % FLASH_SECTOR_SIZE
+            self.flash[addr : addr + sectors * FLASH_SECTOR_SIZE] = b"\xff" * min(sectors * FLASH_SECTOR_SIZE, FLASH_SIZE - addr)
+        elif command in ("GAID", "Gaid"):
+            self.boot()
+        elif command != "DISC":
+            self.registers[register_definitions.command1.address] = unrecognized_command
+            return
+        self.registers[register_definitions.data1.address] = output + [0] * (register_definitions.data1.size - len(output))
+        self.registers[register_definitions.command1.address] = [0] * register_definitions.command1.size
+
+
+class SimulatedSMBus:
+    # smbus2.SMBus replacement talking to a simulated device
+    def __init__(self, device):
+        self.device = device
+        self.submissions = 0  # I2C_RDWR ioctls a real bus would have made
+
+    def i2c_rdwr(self, *msgs):
+        # Register write: [reg, length, data...], register read: [reg] followed by a read message
+        # Several of them may be combined in one submission
+        self.submissions += 1
+        for msg in msgs:
+            if not self.device.responds(msg.addr):
+                raise OSError(121, "Remote I/O error")
+        idx = 0
+        while idx < len(msgs):
+            payload = bytes(msgs[idx])
+            if idx + 1 < len(msgs) and msgs[idx + 1].flags & I2C_M_RD:
+                data = bytes(self.device.read_register(payload[0]))
+                ctypes.memmove(msgs[idx + 1].buf, data[:msgs[idx + 1].len].ljust(msgs[idx + 1].len, b"\0"), msgs[idx + 1].len)
+                idx += 2
+            else:
+                self.device.write_register(payload[0], payload[2 : 2 + payload[1]])
+                idx += 1
+
+    def close(self):
+        pass
+
+
+class SimulatedI2CTarget:
+    # Bit level I2C target state machine driven by the SDA/SCL edges of the simulated CBUS pins
+    def __init__(self, device):
+        self.device = device
+        self.state = "idle"
+        self.sda_low = False
+
+    def start(self):
+        self.finish_write()
+        self.state = "address"
+        self.shift = 0
+        self.bits = 0
+        self.sda_low = False
+
+    def stop(self):
+        self.finish_write()
+        self.state = "idle"
+        self.sda_low = False
+
+    def finish_write(self):
+        if self.state in ("receive", "ack_receive") and self.received:
+            self.device.write_register(self.register, self.received[1 : 1 + self.received[0]])
+        self.received = []
+
+    def scl_rising(self, sda):
+        if self.state in ("address", "receive"):
+            self.shift = (self.shift << 1) | sda
+            self.bits += 1
+        elif self.state == "wait_ack":
+            self.master_ack = not sda
+
+    def scl_falling(self):
+        if self.state in ("address", "receive") and self.bits == 8:
+            byte = self.shift
+            self.shift = 0
+            self.bits = 0
+            if self.state == "address":
+                if not self.device.responds(byte >> 1):
+                    self.state = "ignore"
+                    return
+                if byte & 1:
+                    self.transmit = self.device.read_register(self.register)
+                    self.state = "ack_transmit"
+                else:
+                    self.register = None
+                    self.received = []
+                    self.state = "ack_receive"
+            else:
+                if self.register is None:
+                    self.register = byte
+                else:
+                    self.received.append(byte)
+                self.state = "ack_receive"
+            self.sda_low = True
+        elif self.state == "ack_receive":
+            self.sda_low = False
+            self.state = "receive"
+        elif self.state in ("ack_transmit", "wait_ack"):
+            if self.state == "wait_ack" and not self.master_ack:
+                self.sda_low = False
+                self.state = "ignore"
+                return
+            self.byte = self.transmit.pop(0) if self.transmit else 0
+            self.bit = 7
+            self.sda_low = not (self.byte >> 7) & 1
+            self.state = "transmit"
+        elif self.state == "transmit":
+            self.bit -= 1
+            if self.bit < 0:
+                self.sda_low = False
+                self.state = "wait_ack"
+            else:
+                self.sda_low = not (self.byte >> self.bit) & 1
+
+
+class SimulatedFtdi:
+    # FT230X CBUS GPIO model with open drain SDA/SCL lines shared with a simulated I2C target
+    has_cbus = True
+
+    def __init__(self, device, sda_mask = 0x1, scl_mask = 0x8, usb_latency = 0):
+        self.target = SimulatedI2CTarget(device)
+        self.sda_mask = sda_mask
+        self.scl_mask = scl_mask
+        self.usb_latency = usb_latency
+        self.direction = 0
+        self.sda = 1
+        self.scl = 1
+        self.usb_ops = 0
+
+    def set_cbus_direction(self, mask, direction):
+        self.direction = direction & mask
+
+    def apply(self):
+        # Outputs are driven low, inputs are released and pulled up
+        self.usb_ops += 1
+        if self.usb_latency:
+            time.sleep(self.usb_latency)
+        scl = 0 if self.direction & self.scl_mask else 1
+        master_sda = 0 if self.direction & self.sda_mask else 1
+        sda = master_sda and not self.target.sda_low
+        if scl != self.scl and sda != self.sda:
+            raise AssertionError("SDA and SCL changed in the same CBUS update")
+        if scl != self.scl:
+            self.scl = scl
+            if scl:
+                self.target.scl_rising(sda)
+            else:
+                self.target.scl_falling()
+        elif scl and sda != self.sda:
+            if sda:
+                self.target.stop()
+            else:
+                self.target.start()
+        self.sda = int(master_sda and not self.target.sda_low)
+
+    def set_cbus_gpio(self, pins):
+        self.apply()
+
+    def get_cbus_gpio(self):
+        # pyftdi sets the CBUS bitmode before reading the pins, two USB transfers
+        self.apply()
+        self.usb_ops += 1
+        return (self.sda_mask if self.sda else 0) | (self.scl_mask if self.scl else 0)
+
+    def close(self):
+        pass
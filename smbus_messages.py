@@ -0,0 +1,45 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ctypes import create_string_buffer
+import smbus2
+
+MAX_WRITE_SIZE = 2 + 64  # register address, length byte and a full Data1 payload
+WRITE_SLOTS = 2  # register writes in a single I2C_RDWR submission, Data1 and CMD1
+MAX_READS = 21  # register reads in a single I2C_RDWR submission, i2c-dev takes at most 42 messages
+
+
+class RegisterMessages:
+    # Preallocated i2c_msg structures for the register writes and reads of one I2C target
+    # Messages are reused by every submission, their content is only valid until the next one
+    def __init__(self, addr):
+        self.addr = addr
+        self.write_buffers = [create_string_buffer(MAX_WRITE_SIZE) for slot in range(WRITE_SLOTS)]
+        self.writes = [smbus2.i2c_msg(addr = addr, flags = 0, len = 0, buf = buffer) for buffer in self.write_buffers]
+        self.reads = {}
+
+    def write(self, slot, reg, data):
+        # Register write [reg, length, data...] in the given write slot
+        # Buffers such as image views are copied straight into the message, lists of ints are converted first
+        length = len(data)
+        self.write_buffers[slot][0 : 2] = bytes([reg & 0xFF, length & 0xFF])
+        self.write_buffers[slot][2 : 2 + length] = data if not isinstance(data, list) else bytes(data)
+        self.writes[slot].len = 2 + length
+        return self.writes[slot]
+
+    def read(self, reg, length):
+        # (register pointer write, read) message pair for length bytes of the register
+        if (reg, length) not in self.reads:
+            self.reads[(reg, length)] = (smbus2.i2c_msg.write(self.addr, [reg]), smbus2.i2c_msg.read(self.addr, length))
+        return self.reads[(reg, length)]
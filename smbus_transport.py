@@ -0,0 +1,68 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import smbus2
+import smbus_messages
+
+
+class SMBusTransport:
+    # Native I2C adapter through i2c-dev, register accesses are combined into single I2C_RDWR submissions
+    combines_transfers = True
+    max_reads = smbus_messages.MAX_READS
+    last_usb_ops = 0
+
+    def __init__(self, device, bus = None, **options):
+        # device is the I2C bus number
+        self.name = f"i2c-{device}"
+        self.bus = bus if bus is not None else smbus2.SMBus(device)
+        self.messages = {}  # preallocated i2c_msg structures per I2C address
+
+    def register_messages(self, addr):
+        if addr not in self.messages:
+            self.messages[addr] = smbus_messages.RegisterMessages(addr)
+        return self.messages[addr]
+
+    def write(self, addr, reg, data):
+        self.bus.i2c_rdwr(self.register_messages(addr).write(0, reg, data))
+
+    def read(self, addr, reg, length):
+        msgw, msg = self.register_messages(addr).read(reg, length)
+        self.bus.i2c_rdwr(msgw, msg)
+        return list(bytes(msg))
+
+    def transfer(self, addr, operations):
+        # A single I2C_RDWR ioctl with repeated starts between the messages
+        messages = self.register_messages(addr)
+        msgs = []
+        reads = []
+        slot = 0
+        for operation in operations:
+            if operation[0] == "write":
+                msgs.append(messages.write(slot, operation[1], operation[2]))
+                slot += 1
+            else:
+                msgs += messages.read(operation[1], operation[2])
+                reads.append(msgs[-1])
+        self.bus.i2c_rdwr(*msgs)
+        return [list(bytes(msg)) for msg in reads]
+
+    def recover(self):
+        # I2C adapter drivers recover the bus on their own
+        return None
+
+    def calibrate(self, probe, force = False):
+        return None
+
+    def close(self):
+        self.bus.close()
@@ -0,0 +1,137 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+from collections import namedtuple
+
+PROGRESS_INTERVAL = 0.5  # seconds between progress updates of a phase
+
+# Totals of a finished phase, duration in seconds
+Phase = namedtuple('Phase', ['name', 'bytes', 'duration', 'commands', 'retries', 'success'])
+
+
+class StationMetrics:
+    # Per-phase timing and throughput of a board, progress goes to the console and, as JSON Lines, to progress_fd
+    def __init__(self, PDC, label, progress_fd = None):
+        self.PDC = PDC
+        self.label = label
+        self.progress_fd = progress_fd
+        self.phases = []
+        self.name = None
+
+    def commands(self):
+        stats = self.PDC.command_stats
+        return sum(len(latencies) for latencies in stats.latencies.values()) + sum(stats.failures.values())
+
+    def retries(self):
+        return sum(self.PDC.retry_counts.values())
+
+    def start(self, name, total):
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.started = time.monotonic()
+        self.last_update = self.started
+        self.start_commands = self.commands()
+        self.start_retries = self.retries()
+        self.emit({"event": "start", "phase": name, "bytes_total": total})
+
+    def rates(self, now):
+        # (elapsed, bytes/s, 4CC commands/s, retries, ETA in seconds or None) of the current phase
+        elapsed = now - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0
+        command_rate = (self.commands() - self.start_commands) / elapsed if elapsed > 0 else 0
+        eta = (self.total - self.done) / rate if rate > 0 else None
+        return elapsed, rate, command_rate, self.retries() - self.start_retries, eta
+
+    def progress(self, done, addr):
+        self.done = done
+        now = time.monotonic()
+        if now - self.last_update < PROGRESS_INTERVAL:
+            return
+        self.last_update = now
+        elapsed, rate, command_rate, retries, eta = self.rates(now)
+        percent = int(done * 100 / self.total) if self.total else 100
+        eta_text = f"{eta:.0f}s" if eta is not None else "-"
+        print(f"{self.name.capitalize()} {percent:02d}% - {hex(addr)} {rate / 1024:.1f}KB/s {command_rate:.0f} 4CC/s ETA {eta_text}", end="\r")
+        self.emit({
+            "event": "progress",
+            "phase": self.name,
+            "address": addr,
+            "bytes": done,
+            "bytes_total": self.total,
+            "elapsed": elapsed,
+            "bytes_per_second": rate,
+            "commands_per_second": command_rate,
+            "retries": retries,
+            "eta": eta,
+        })
+
+    def end(self, success, done = None):
+        # done defaults to the last reported progress
+        if done is not None:
+            self.done = done
+        elapsed, rate, command_rate, retries, eta = self.rates(time.monotonic())
+        phase = Phase(self.name, self.done, elapsed, self.commands() - self.start_commands, retries, success)
+        self.phases.append(phase)
+        print(f"{self.name.capitalize()} took {elapsed:.2f}s: {rate:.0f} bytes/s, {command_rate:.0f} 4CC/s, {retries} retries")
+        self.emit({
+            "event": "end",
+            "phase": phase.name,
+            "bytes": phase.bytes,
+            "duration": phase.duration,
+            "commands": phase.commands,
+            "retries": phase.retries,
+            "success": phase.success,
+            "bytes_per_second": rate,
+            "commands_per_second": command_rate,
+        })
+        self.name = None
+
+    def event(self, name, **fields):
+        self.emit({"event": name, "phase": self.name, **fields})
+
+    def emit(self, entry):
+        # A single write per line keeps the lines of boards sharing the descriptor whole
+        if self.progress_fd is None:
+            return
+        entry = {"timestamp": time.time(), "board": self.label, **entry}
+        os.write(self.progress_fd, (json.dumps(entry) + "\n").encode())
+
+    def write_textfile(self, path, success):
+        # Prometheus node_exporter textfile, replaced atomically so a scrape never sees a partial file
+        board = f'board="{self.label}"'
+        metrics = [
+            ("tps65988_phase_duration_seconds", "Wall time of the phase", [(phase, phase.duration) for phase in self.phases]),
+            ("tps65988_phase_bytes", "Bytes processed by the phase", [(phase, phase.bytes) for phase in self.phases]),
+            ("tps65988_phase_bytes_per_second", "Throughput of the phase", [(phase, phase.bytes / phase.duration if phase.duration > 0 else 0) for phase in self.phases]),
+            ("tps65988_phase_commands", "4CC commands issued by the phase", [(phase, phase.commands) for phase in self.phases]),
+            ("tps65988_phase_retries", "Transaction, 4CC and bus recovery retries during the phase", [(phase, phase.retries) for phase in self.phases]),
+            ("tps65988_phase_success", "1 when the phase succeeded", [(phase, int(phase.success)) for phase in self.phases]),
+        ]
+        lines = []
+        for name, description, values in metrics:
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+            lines += [f'{name}{{{board},phase="{phase.name}"}} {value}' for phase, value in values]
+        lines += ["# HELP tps65988_retries_total Retries during the run by kind", "# TYPE tps65988_retries_total counter"]
+        lines += [f'tps65988_retries_total{{{board},kind="{kind}"}} {count}' for kind, count in self.PDC.retry_counts.items()]
+        lines += ["# HELP tps65988_run_success 1 when every operation of the run succeeded", "# TYPE tps65988_run_success gauge"]
+        lines += [f"tps65988_run_success{{{board}}} {int(success)}"]
+        lines += ["# HELP tps65988_run_timestamp_seconds End of the run", "# TYPE tps65988_run_timestamp_seconds gauge"]
+        lines += [f"tps65988_run_timestamp_seconds{{{board}}} {time.time():.3f}"]
+        with open(path + ".tmp", "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
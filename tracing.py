@@ -0,0 +1,61 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+from collections import deque, namedtuple
+
+# timestamp and duration in seconds, kind is "read", "write" or "4cc"
+TraceRecord = namedtuple('TraceRecord', ['timestamp', 'duration', 'transport', 'kind', 'address', 'register', 'length', 'ack', 'command', 'usb_ops'])
+
+
+class Tracer:
+    # Ring buffer of the most recent bus transactions and 4CC commands
+    def __init__(self, capacity = 65536):
+        self.records = deque(maxlen = capacity)
+        # perf_counter() timestamps are converted to wall clock time on export only
+        self.epoch = time.time() - time.perf_counter()
+
+    def record(self, *fields):
+        self.records.append(TraceRecord(*fields))
+
+    def export_jsonl(self, path):
+        with open(path, "w") as file:
+            for record in self.records:
+                entry = record._asdict()
+                entry["timestamp"] += self.epoch
+                file.write(json.dumps(entry) + "\n")
+
+    def export_chrome(self, path):
+        # Chrome trace event format, viewable in chrome://tracing or Perfetto
+        events = []
+        for record in self.records:
+            name = record.command if record.kind == "4cc" else f"{record.kind} {record.register:#04x}"
+            events.append({
+                "name": name,
+                "cat": record.kind,
+                "ph": "X",
+                "ts": (record.timestamp + self.epoch) * 1e6,
+                "dur": record.duration * 1e6,
+                "pid": record.transport,
+                "tid": "4CC" if record.kind == "4cc" else f"I2C {record.address:#04x}",
+                "args": {
+                    "length": record.length,
+                    "ack": record.ack,
+                    "command": record.command,
+                    "usb_ops": record.usb_ops,
+                },
+            })
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
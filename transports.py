@@ -0,0 +1,71 @@
+# Copyright 2025 Antmicro
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Bus transports of the TPS65988 driver, each backend module is imported only when its transport is opened
+#
+# factory(device, bus = None, **options) returns an object with:
+#   name                      label used in traces and metrics
+#   combines_transfers        True when transfer() submits several register accesses at once
+#   max_reads                 register reads transfer() takes in one submission
+#   last_usb_ops              USB operations of the last transaction, 0 for native adapters
+#   write(addr, reg, data)    register write, the transport prefixes the length byte
+#   read(addr, reg, length)   register read of length bytes (length byte included) as a list
+#   transfer(addr, operations) ("write", reg, data) and ("read", reg, length) accesses, returns the read contents
+#   recover()                 release a stuck bus, None when the adapter driver does it on its own
+#   calibrate(probe, force)   tune the bit rate, probe() runs a test transaction
+#   close()
+# Failed accesses raise OSError or ValueError
+
+import os
+import time
+import importlib
+
+# Transport name: "module:factory"
+registry = {
+    "smbus": "smbus_transport:SMBusTransport",
+    "ft230x": "ft230x:open_transport",
+}
+# External transports as "name=module:factory" entries separated by commas
+PLUGINS_VARIABLE = "TPS65988_TRANSPORTS"
+import_times = {}  # seconds spent importing each loaded backend
+
+
+def register(name, spec):
+    registry[name] = spec
+
+
+def register_plugins(text):
+    for entry in text.split(","):
+        if entry.strip():
+            name, spec = entry.split("=", 1)
+            register(name.strip(), spec.strip())
+
+
+def load(name, verbose = False):
+    module_name, factory = registry[name].split(":")
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if name not in import_times:
+        import_times[name] = time.perf_counter() - start
+        if verbose:
+            print(f"Loaded the {name} transport from {module_name} in {import_times[name] * 1000:.1f}ms")
+    return getattr(module, factory)
+
+
+def open_transport(name, device, bus = None, verbose = False, **options):
+    # bus is an already opened bus (e.g. a simulated one) for the transport to use
+    return load(name, verbose)(device, bus = bus, **options)
+
+
+register_plugins(os.environ.get(PLUGINS_VARIABLE, ""))